@@ -0,0 +1,200 @@
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from main import *
+
+# Vocabulary used to build realistic recipes
+QUANTITIES = ['1', '2', '3', '1/2', '1/4', '3/4', '1 1/2', '4', '6', '8']
+UNITS = ['cup', 'cups', 'teaspoon', 'teaspoons', 'tablespoon', 'Tablespoons', 'pound', 'ounces', 'cloves', 'whole', 'pinch', 'can']
+INGREDIENTS = [
+    'all-purpose flour', 'granulated sugar', 'unsalted butter, softened', 'large eggs', 'whole milk', 'fine grain sea salt',
+    'extra virgin olive oil', 'yellow onion, diced', 'garlic, minced', 'fresh basil leaves', 'grated Parmesan cheese',
+    'ground cumin', 'black pepper', 'heavy cream', 'baking powder', 'vanilla extract', 'lemon juice', 'carrots, peeled',
+    'celery stalks', 'chicken broth', 'brown sugar', 'red wine vinegar', 'soy sauce', 'fresh cilantro', 'green onions'
+]
+CHILI_INGREDIENTS = ['Chili powder', 'green chiles, chopped', 'red chilies', 'dried chile flakes', 'Chilli oil', 'serrano chile']
+WORDS = ['simple', 'weeknight', 'dinner', 'comforting', 'crispy', 'fresh', 'summer', 'family', 'favorite', 'quick', 'spicy', 'classic']
+DURATIONS = ['PT5M', 'PT10M', 'PT15M', 'PT20M', 'PT30M', 'PT45M', 'PT1H', 'PT1H30M', 'PT2H', 'PT4H', '']
+
+# Function to build one synthetic recipe
+"""
+    :param rng: random.Random
+    :param index: line number, used for unique names and urls
+    :param chiliRate: probability that the recipe contains chilies
+    :return: recipe dict
+"""
+def generate_recipe(rng, index, chiliRate):
+    ingredients = [f"{rng.choice(QUANTITIES)} {rng.choice(UNITS)} {rng.choice(INGREDIENTS)}" for _ in range(rng.randint(4, 12))]
+    if rng.random() < chiliRate:
+        ingredients.insert(rng.randrange(len(ingredients)), f"{rng.choice(QUANTITIES)} {rng.choice(UNITS)} {rng.choice(CHILI_INGREDIENTS)}")
+    title = ' '.join(rng.choice(WORDS) for _ in range(3)).title()
+    return {
+        'name': f"{title} {index}",
+        'ingredients': '\n'.join(ingredients),
+        'url': f"http://example.com/recipes/{index}",
+        'image': f"http://example.com/images/{index}.jpg",
+        'cookTime': rng.choice(DURATIONS),
+        'recipeYield': str(rng.randint(1, 12)),
+        'datePublished': f"20{rng.randint(5, 13):02d}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        'prepTime': rng.choice(DURATIONS),
+        'description': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(10, 40))) + '\nmore'
+    }
+
+# Function to write a synthetic recipes jsonl file
+"""
+    :param filePath
+    :param lines: number of recipes
+    :param chiliRate: share of recipes that contain chilies
+    :param seed: random seed, the same seed gives the same file
+"""
+def generate_recipes_file(filePath, lines, chiliRate=0.05, seed=42):
+    rng = random.Random(seed)
+    with open(filePath, 'w', encoding='utf-8') as file:
+        for index in range(lines):
+            file.write(json.dumps(generate_recipe(rng, index, chiliRate)) + '\n')
+
+# Function to measure the memory allocated by one stage: the peak traced by tracemalloc while it runs, above what was allocated before
+# The peak RSS of the process only ever grows, so it would report the largest earlier stage for every later one
+"""
+    :param function: stage to run
+    :return: peak in MB
+"""
+def stage_peak_mb(function, *args):
+    # The interpreter may already trace, e.g. with -X tracemalloc, then only the peak is reset
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    try:
+        function(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return (peak - before) / (1024 * 1024)
+
+# Options of the benchmark run, traceMemory runs every stage a second time under tracemalloc to record its peak memory
+BENCHMARK_OPTIONS = {'traceMemory': True}
+
+# Function to time one stage and record its throughput and memory
+# tracemalloc slows allocations down several times, so the stage is timed without it and run a second time to trace its peak
+"""
+    :param results: list the stage result is appended to
+    :param name: stage name
+    :param rows: number of rows going into the stage, None to use the number of rows it returns
+    :param function: stage to run, it must give the same result when it runs twice
+    :return: return value of the stage
+"""
+def time_stage(results, name, rows, function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    seconds = time.perf_counter() - start
+    if rows is None:
+        rows = len(value)
+    results.append({'stage': name, 'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds > 0 else None,
+                    'peak_mb': stage_peak_mb(function, *args) if BENCHMARK_OPTIONS['traceMemory'] else None})
+    return value
+
+# Function to run every stage of the ETL on a recipes file
+"""
+    :param filePath: recipes jsonl file
+    :param workDir: directory for the csv outputs
+    :param traceMemory: also record the peak memory of every stage, see time_stage
+    :return: list of stage results
+"""
+def run_benchmark(filePath, workDir, traceMemory=True):
+    results = []
+    BENCHMARK_OPTIONS['traceMemory'] = traceMemory
+    # main imports pandas, numpy and isodate lazily, they are loaded here so that no stage is timed with their import
+    for module in (pd, np, isodate):
+        getattr(module, '__name__')
+    jsonData = time_stage(results, 'read_json_file', None, read_json_file, filePath)
+    results[-1]['mb_per_second'] = os.path.getsize(filePath) / (1024 * 1024) / results[-1]['seconds']
+    lines = len(jsonData)
+
+    recipes = time_stage(results, 'extract_chilies_recipes', len(jsonData), extract_chilies_recipes, jsonData)
+    del jsonData
+    recipes = time_stage(results, 'iter_unique_recipes', len(recipes), lambda: list(iter_unique_recipes(recipes)))
+    recipesDF = time_stage(results, 'build_recipes_frame', len(recipes), build_recipes_frame, recipes)
+    if recipesDF.empty:
+        return results
+
+    cook, prep = time_stage(results, 'convert_durations_to_minutes', 2 * len(recipesDF), lambda: (
+        convert_durations_to_minutes(recipesDF['cookTime'], errors='coerce')[0],
+        convert_durations_to_minutes(recipesDF['prepTime'], errors='coerce')[0]))
+    recipesDF['cookTime_minutes'], recipesDF['prepTime_minutes'] = cook, prep
+    time_stage(results, 'convert_duration_to_minutes (scalar apply)', 2 * len(recipesDF), lambda: (
+        recipesDF['cookTime'].apply(convert_duration_to_minutes), recipesDF['prepTime'].apply(convert_duration_to_minutes)))
+
+    difficulty, total_time = time_stage(results, 'calculate_difficulty_columns', len(recipesDF), calculate_difficulty_columns,
+                                        recipesDF['cookTime_minutes'], recipesDF['prepTime_minutes'])
+    recipesDF['difficulty'], recipesDF['total_time'] = difficulty, total_time
+    recipesDF = recipesDF[recipesDF['difficulty'] != 'Unknown Difficulty']
+
+    stats = time_stage(results, 'groupby difficulty', len(recipesDF), lambda: update_difficulty_stats({}, recipesDF))
+    time_stage(results, 'write Results.csv', len(stats), write_results, stats, os.path.join(workDir, 'Results.csv'))
+    time_stage(results, 'write Chilies.csv', len(recipesDF), lambda: clean_newlines(recipesDF.drop(columns=HELPER_COLUMNS))
+               .to_csv(os.path.join(workDir, 'Chilies.csv'), sep='|', index=False))
+
+    # The whole pipeline in a single streaming pass, for comparison with the sum of the stages above
+    time_stage(results, 'run_streaming_etl (end to end)', lines, run_streaming_etl, filePath,
+               os.path.join(workDir, 'Chilies.csv'), os.path.join(workDir, 'Results.csv'))
+    return results
+
+# Function to print the stage results, compared with a baseline when one is given
+"""
+    :param results: list of stage results
+    :param baseline: list of stage results of an earlier run, or None
+"""
+def print_report(results, baseline=None):
+    # Throughput is compared rather than seconds, so baselines of a different corpus size stay comparable
+    baseline_throughput = {result['stage']: result['rows_per_second'] for result in baseline or []}
+    print(f"{'stage':<45}{'rows':>12}{'seconds':>12}{'rows/s':>14}{'peak MB':>14}{'speedup':>14}")
+    for result in results:
+        rows_per_second = f"{result['rows_per_second']:.0f}" if result['rows_per_second'] else '-'
+        peak = f"{result['peak_mb']:.1f}" if result.get('peak_mb') is not None else '-'
+        comparison = '-'
+        if baseline_throughput.get(result['stage']) and result['rows_per_second']:
+            comparison = f"{result['rows_per_second'] / baseline_throughput[result['stage']]:.2f}x"
+        print(f"{result['stage']:<45}{result['rows']:>12}{result['seconds']:>12.3f}{rows_per_second:>14}"
+              f"{peak:>14}{comparison:>14}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the stages of the recipes ETL on a synthetic corpus")
+    parser.add_argument('--lines', type=int, default=10000, help="number of synthetic recipes (10k to 10M)")
+    parser.add_argument('--chili-rate', type=float, default=0.05, help="share of recipes that contain chilies")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--input', help="existing recipes file to benchmark instead of a synthetic one")
+    parser.add_argument('--baseline', help="json file of an earlier run to compare with")
+    parser.add_argument('--save', help="write the results as json, e.g. to store a new baseline")
+    parser.add_argument('--no-trace-memory', action='store_true', help="skip the second run of every stage that traces its peak memory")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as workDir:
+        filePath = args.input
+        if filePath is None:
+            filePath = os.path.join(workDir, 'recipes.json')
+            start = time.perf_counter()
+            generate_recipes_file(filePath, args.lines, args.chili_rate, args.seed)
+            print(f"Generated {args.lines} recipes ({os.path.getsize(filePath) / (1024 * 1024):.1f} MB) in {time.perf_counter() - start:.1f}s")
+        results = run_benchmark(filePath, workDir, not args.no_trace_memory)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+    print_report(results, baseline)
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump(results, file, indent=4)
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,60 @@
 import json
 import os
+import sys
 import re
-import requests
-import isodate
-import pandas as pd
-import numpy as np
 import datetime
+import hashlib
+import email.utils
+import argparse
+import collections
+import contextlib
+import importlib
+import importlib.util
+import math
+import mmap
+import shutil
+import cProfile
+import resource
+import time
+import tracemalloc
+import uuid
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+# Function to import a module on first attribute access instead of at import time
+# The heavy dependencies cost several hundred ms to import, a run that has nothing to do should not pay for them
+"""
+    :param name: module name
+    :return: module, loaded the first time one of its attributes is used
+"""
+def lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+requests = lazy_import('requests')
+isodate = lazy_import('isodate')
+pd = lazy_import('pandas')
+np = lazy_import('numpy')
+asyncio = lazy_import('asyncio')
+
+# Optional fast JSON decoders, the standard library json module is used when none is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
 
 # Function to read the config file
 """
@@ -17,91 +66,819 @@ def read_configs( configFile ):
         config = json.load(file)
         return config
 
+# Metrics of the current run, collected by track_stage. None when instrumentation is off.
+RUN_METRICS = None
+
+# Function to start collecting the metrics of a run
+"""
+    :param profileStage: name of a stage to run under cProfile and tracemalloc, None for no profiling
+    :return: metrics dict
+"""
+def start_run_metrics(profileStage=None):
+    global RUN_METRICS
+    RUN_METRICS = {'runId': uuid.uuid4().hex, 'startedAt': datetime.datetime.now().isoformat(),
+                   'start': (time.perf_counter(), time.process_time()), 'stages': {}, 'active': [], 'counters': {},
+                   'profileStage': profileStage, 'profiler': cProfile.Profile() if profileStage else None}
+    return RUN_METRICS
+
+# Function to read the peak resident set size of the process in MB
+"""
+    :return: peak RSS in MB
+"""
+def get_peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# Context manager to measure one stage of the run: wall time, CPU time, rows in/out and how much it raised the peak memory
+# Stages may nest (e.g. parsing happens while the filter pulls recipes), the time spent in a nested stage
+# is not counted in the enclosing one. A stage entered several times (once per chunk) is accumulated.
+"""
+    :param name: stage name
+    :param rowsIn: number of rows going into the stage, can also be set on the yielded dict
+    :return: dict where the caller sets 'rowsIn' and 'rowsOut'
+"""
+@contextlib.contextmanager
+def track_stage(name, rowsIn=None):
+    counts = {'rowsIn': rowsIn, 'rowsOut': None}
+    metrics = RUN_METRICS
+    if metrics is None:
+        yield counts
+        return
+
+    stage = metrics['stages'].setdefault(name, {'wallSeconds': 0.0, 'cpuSeconds': 0.0, 'rowsIn': 0, 'rowsOut': 0, 'calls': 0})
+    now = (time.perf_counter(), time.process_time())
+    if metrics['active']:
+        # Pause the enclosing stage
+        parent = metrics['active'][-1]
+        parent['stage']['wallSeconds'] += now[0] - parent['start'][0]
+        parent['stage']['cpuSeconds'] += now[1] - parent['start'][1]
+    # The peak RSS is process wide and never goes down, so a stage is measured by how much it raised it
+    frame = {'stage': stage, 'start': now, 'peakRssMB': get_peak_rss_mb()}
+    metrics['active'].append(frame)
+
+    profiling = metrics['profileStage'] == name
+    if profiling:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        metrics['profiler'].enable()
+    try:
+        yield counts
+    finally:
+        if profiling:
+            metrics['profiler'].disable()
+            stage['tracemallocPeakMB'] = max(stage.get('tracemallocPeakMB', 0.0), tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+
+        now = (time.perf_counter(), time.process_time())
+        stage['wallSeconds'] += now[0] - frame['start'][0]
+        stage['cpuSeconds'] += now[1] - frame['start'][1]
+        stage['calls'] += 1
+        stage['rowsIn'] += counts['rowsIn'] or 0
+        stage['rowsOut'] += counts['rowsOut'] or 0
+        stage['peakRssGrowthMB'] = max(stage.get('peakRssGrowthMB', 0.0), get_peak_rss_mb() - frame['peakRssMB'])
+        metrics['active'].pop()
+        if metrics['active']:
+            # Resume the enclosing stage
+            metrics['active'][-1]['start'] = now
+
+# Function to add to a counter of the run, counters are emitted with the total of the run metrics
+"""
+    :param name: counter name
+    :param value: amount added to the counter
+"""
+def count_metric(name, value=1):
+    if RUN_METRICS is not None:
+        RUN_METRICS['counters'][name] = RUN_METRICS['counters'].get(name, 0) + value
+
+# Generator to measure the time spent producing the items of an iterable as a stage
+# Meant for chunked iterables, every item costs one track_stage call.
+"""
+    :param iterable
+    :param name: stage name
+    :return: generator of the same items
+"""
+def iter_tracked(iterable, name):
+    if RUN_METRICS is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        with track_stage(name) as counts:
+            item = next(iterator, None)
+            if item is not None:
+                counts['rowsOut'] = len(item) if isinstance(item, list) else 1
+        if item is None:
+            return
+        yield item
+
+# Function to emit the metrics of the run as JSON lines, one per stage plus a total
+"""
+    :param metricsFilePath: file the lines are appended to, None prints them to the run log
+    :param profileOutputPath: file the cProfile stats of the profiled stage are written to
+    :return: list of metric records
+"""
+def emit_run_metrics(metricsFilePath=None, profileOutputPath=None):
+    global RUN_METRICS
+    metrics = RUN_METRICS
+    if metrics is None:
+        return []
+    RUN_METRICS = None
+
+    records = [dict({'runId': metrics['runId'], 'startedAt': metrics['startedAt'], 'stage': name}, **stage) for name, stage in metrics['stages'].items()]
+    now = (time.perf_counter(), time.process_time())
+    records.append({'runId': metrics['runId'], 'startedAt': metrics['startedAt'], 'stage': 'total',
+                    'wallSeconds': now[0] - metrics['start'][0], 'cpuSeconds': now[1] - metrics['start'][1], 'peakRssMB': get_peak_rss_mb(),
+                    **metrics['counters']})
+
+    lines = [json.dumps(record) for record in records]
+    if metricsFilePath:
+        with open(metricsFilePath, 'a') as file:
+            file.write('\n'.join(lines) + '\n')
+    else:
+        for line in lines:
+            print(line)
+
+    if metrics['profiler'] is not None:
+        metrics['profiler'].dump_stats(profileOutputPath or f"profile-{metrics['profileStage']}.prof")
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+    return records
+
+# Function to create a requests session with a connection pool sized for parallel range requests
+"""
+    :param poolSize: number of connections kept open per host
+    :return: requests.Session
+"""
+def create_http_session(poolSize=10):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=poolSize, pool_maxsize=poolSize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+# Function to read the metadata (validators, completed ranges) stored next to a downloaded file
+"""
+    :param saveFilePath
+    :return: metadata dict, or None if there is none
+"""
+def load_download_meta(saveFilePath):
+    metaFilePath = saveFilePath + '.meta.json'
+    if not os.path.isfile(metaFilePath):
+        return None
+    with open(metaFilePath, 'r') as file:
+        return json.load(file)
+
+# Function to store the metadata of a downloaded file
+"""
+    :param saveFilePath
+    :param meta
+"""
+def save_download_meta(saveFilePath, meta):
+    with open(saveFilePath + '.meta.json', 'w') as file:
+        json.dump(meta, file)
+
+# Function to get the ETag and Last-Modified validators of a response, only when the server sent them
+"""
+    :param response
+    :return: dict with 'etag' and 'lastModified' (string or None)
+"""
+def get_validators(response):
+    etag = response.headers.get('ETag')
+    lastModified = response.headers.get('Last-Modified')
+    return {'etag': etag if isinstance(etag, str) else None,
+            'lastModified': lastModified if isinstance(lastModified, str) else None}
+
+# Function to build the conditional request headers for an already downloaded file
+"""
+    :param saveFilePath
+    :param meta: download metadata of a complete download, or None
+    :return: dict of headers, empty if the file does not exist
+"""
+def get_conditional_headers(saveFilePath, meta):
+    if not os.path.isfile(saveFilePath):
+        return {}
+    if meta is None:
+        # File downloaded without metadata, fall back to its modification time
+        return {'If-Modified-Since': email.utils.formatdate(os.path.getmtime(saveFilePath), usegmt=True)}
+    headers = {}
+    if meta.get('etag'):
+        headers['If-None-Match'] = meta['etag']
+    if meta.get('lastModified'):
+        headers['If-Modified-Since'] = meta['lastModified']
+    return headers
+
+# Function to download one byte range of the file and write it at its offset
+"""
+    :param http: requests session
+    :param sourceFileUrl
+    :param saveFilePath: preallocated file
+    :param byteRange: (start, end) with end exclusive
+    :param validator: ETag or Last-Modified the range must belong to
+    :param chunkSize
+"""
+def download_range(http, sourceFileUrl, saveFilePath, byteRange, validator, chunkSize):
+    start, end = byteRange
+    headers = {'Range': f"bytes={start}-{end - 1}"}
+    if validator:
+        headers['If-Range'] = validator
+    response = http.get(sourceFileUrl, stream=True, headers=headers)
+    response.raise_for_status()
+    if response.status_code != 206:
+        raise requests.exceptions.RequestException(f"Server ignored the range request for bytes {start}-{end - 1}")
+
+    with open(saveFilePath, 'r+b') as file:
+        file.seek(start)
+        for chunk in response.iter_content(chunk_size=chunkSize):
+            if chunk:
+                file.write(chunk)
+
+# Function to download a file as parallel byte ranges, completed ranges are recorded so an interrupted download resumes
+"""
+    :param http: requests session
+    :param sourceFileUrl
+    :param saveFilePath
+    :param size: Content-Length of the file
+    :param validators: validators of the current version of the file
+    :param meta: metadata of a previous incomplete download, or None
+    :param rangeWorkers: number of ranges downloaded at the same time
+    :param rangeSize: size of one range in bytes
+    :param chunkSize
+"""
+def download_parallel_ranges(http, sourceFileUrl, saveFilePath, size, validators, meta, rangeWorkers, rangeSize, chunkSize):
+    completed = []
+    if meta and not meta.get('complete') and meta.get('size') == size and meta.get('etag') == validators['etag'] \
+            and meta.get('lastModified') == validators['lastModified'] and os.path.isfile(saveFilePath):
+        completed = [tuple(byteRange) for byteRange in meta.get('completedRanges', [])]
+
+    # Preallocate the file so every range can be written at its offset
+    with open(saveFilePath, 'r+b' if completed else 'wb') as file:
+        file.truncate(size)
+
+    meta = dict(validators, url=sourceFileUrl, size=size, complete=False, completedRanges=[list(byteRange) for byteRange in completed])
+    save_download_meta(saveFilePath, meta)
+
+    pending = [(start, min(start + rangeSize, size)) for start in range(0, size, rangeSize)]
+    pending = [byteRange for byteRange in pending if byteRange not in completed]
+    validator = validators['etag'] or validators['lastModified']
+    with ThreadPoolExecutor(max_workers=rangeWorkers) as executor:
+        futures = {executor.submit(download_range, http, sourceFileUrl, saveFilePath, byteRange, validator, chunkSize): byteRange
+                   for byteRange in pending}
+        for future in as_completed(futures):
+            future.result()
+            meta['completedRanges'].append(list(futures[future]))
+            save_download_meta(saveFilePath, meta)
+
+    meta['complete'] = True
+    save_download_meta(saveFilePath, meta)
+
+# Messages of download_file for every download status
+DOWNLOAD_MESSAGES = {'downloaded': "File downloaded successfully and saved to {}", 'not_modified': "File not modified, keeping {}"}
+
+# Function to move a complete download over the local copy and record its validators
+"""
+    :param sourceFileUrl
+    :param saveFilePath
+    :param validators: validators of the downloaded version of the file
+"""
+def finish_download(sourceFileUrl, saveFilePath, validators):
+    partFilePath = saveFilePath + '.part'
+    os.replace(partFilePath, saveFilePath)
+    if validators['etag'] or validators['lastModified']:
+        save_download_meta(saveFilePath, dict(validators, url=sourceFileUrl, complete=True))
+    elif os.path.isfile(saveFilePath + '.meta.json'):
+        # The validators of the previous version do not describe the new file
+        os.remove(saveFilePath + '.meta.json')
+    if os.path.isfile(partFilePath + '.meta.json'):
+        os.remove(partFilePath + '.meta.json')
+
+# Function to download the file
+# Requests are conditional when the file was downloaded before (ETag / Last-Modified) and large files can be fetched as
+# parallel ranges. A changed file is downloaded to <saveFilePath>.part and only replaces the local copy once it is complete,
+# so a failed download keeps the previous copy, and an interrupted download is resumed from the .part file with a Range request.
+"""
+    :param sourceFileUrl
+    :param saveFilePath
+    :param session: requests.Session to reuse pooled connections, defaults to plain requests calls
+    :param chunkSize: size of the chunks read from the response
+    :param rangeWorkers: number of parallel range requests, 1 downloads the file in a single request
+    :param rangeSize: size of one range in bytes when downloading in parallel
+    :return: 'downloaded' or 'not_modified', the exception of a failed download is raised
+"""
+def fetch_file(sourceFileUrl, saveFilePath, session=None, chunkSize=8192, rangeWorkers=1, rangeSize=16 * 1024 * 1024):
+    http = session or requests
+    partFilePath = saveFilePath + '.part'
+    meta = load_download_meta(saveFilePath)
+    if meta is not None and (meta.get('url') != sourceFileUrl or not meta.get('complete')):
+        meta = None
+    partMeta = load_download_meta(partFilePath)
+    if partMeta is not None and (partMeta.get('url') != sourceFileUrl or not os.path.isfile(partFilePath)):
+        partMeta = None
+
+    # A single request download is resumed after the bytes of the .part file, parallel ranges resume their own way
+    resuming = partMeta is not None and 'completedRanges' not in partMeta and bool(partMeta.get('etag') or partMeta.get('lastModified'))
+    headers = get_conditional_headers(saveFilePath, meta)
+
+    if rangeWorkers > 1:
+        # Ask for the size first, the HEAD request is conditional too
+        head = http.head(sourceFileUrl, allow_redirects=True, headers=headers)
+        if head.status_code == 304:
+            return 'not_modified'
+        head.raise_for_status()
+        size = int(head.headers.get('Content-Length', 0))
+        if head.headers.get('Accept-Ranges') == 'bytes' and size > rangeSize:
+            validators = get_validators(head)
+            download_parallel_ranges(http, sourceFileUrl, partFilePath, size, validators, partMeta, rangeWorkers, rangeSize, chunkSize)
+            finish_download(sourceFileUrl, saveFilePath, validators)
+            return 'downloaded'
+        # The file changed, it is downloaded again in a single request
+        headers = {}
+
+    if resuming:
+        # If-Range makes the server send the whole file if it changed since the .part file was started
+        headers = {'Range': f"bytes={os.path.getsize(partFilePath)}-", 'If-Range': partMeta.get('etag') or partMeta.get('lastModified')}
+
+    # Send a GET request to the URL
+    if headers:
+        response = http.get(sourceFileUrl, stream=True, headers=headers)
+    else:
+        response = http.get(sourceFileUrl, stream=True)
+
+    if response.status_code == 304:
+        return 'not_modified'
+    if response.status_code == 416:
+        # The bytes of the .part file do not fit the current file anymore, download it again from the start
+        response = http.get(sourceFileUrl, stream=True)
+
+    # Check if the request was successful
+    response.raise_for_status()
+
+    # Validators are stored before the body so an interrupted download can be resumed
+    validators = get_validators(response)
+    if validators['etag'] or validators['lastModified']:
+        save_download_meta(partFilePath, dict(validators, url=sourceFileUrl, complete=False))
+
+    # Open the .part file in binary write mode (append mode when resuming) and save the content
+    written = 0
+    with open(partFilePath, 'ab' if response.status_code == 206 else 'wb') as file:
+        for chunk in response.iter_content(chunk_size=chunkSize):
+            if chunk:
+                file.write(chunk)
+                written += len(chunk)
+
+    # A connection closed before the end of the body is not always reported, compare with the announced length
+    expected = response.headers.get('Content-Length')
+    if isinstance(expected, str) and expected.isdigit() and response.headers.get('Content-Encoding') in (None, 'identity') \
+            and written != int(expected):
+        raise requests.exceptions.ChunkedEncodingError(f"Connection closed after {written} of {expected} bytes")
+
+    finish_download(sourceFileUrl, saveFilePath, validators)
+    return 'downloaded'
+
+# Function to describe a failed download
+"""
+    :param err: exception raised by fetch_file
+    :return: message
+"""
+def describe_download_error(err):
+    if isinstance(err, requests.exceptions.HTTPError):
+        return f"HTTP error occurred: {err}"
+    if isinstance(err, requests.exceptions.ConnectionError):
+        return f"Connection error occurred: {err}"
+    if isinstance(err, requests.exceptions.Timeout):
+        return f"Timeout error occurred: {err}"
+    if isinstance(err, requests.exceptions.RequestException):
+        return f"An error occurred: {err}"
+    return f"An unexpected error occurred: {err}"
+
 # Function to download the file
 """
     :param sourceFileUrl
     :param saveFilePath
-    :return: file
+    :param session: requests.Session to reuse pooled connections, defaults to plain requests calls
+    :param chunkSize: size of the chunks read from the response
+    :param rangeWorkers: number of parallel range requests, 1 downloads the file in a single request
+    :param rangeSize: size of one range in bytes when downloading in parallel
+    :return: message, see fetch_file for the status and the exception of a failed download
 """
-def download_file(sourceFileUrl, saveFilePath):
+def download_file(sourceFileUrl, saveFilePath, session=None, chunkSize=8192, rangeWorkers=1, rangeSize=16 * 1024 * 1024):
     try:
-        # Send a GET request to the URL
-        response = requests.get(sourceFileUrl, stream=True)
-
-        # Check if the request was successful
-        response.raise_for_status()
-        
-        # Open the file in binary write mode and save the content
-        with open(saveFilePath, 'wb') as file:
-            for chunk in response.iter_content(chunk_size=8192):
-                if chunk:
-                    file.write(chunk)
-            #file.write(response.content)
-        
-        return f"File downloaded successfully and saved to {saveFilePath}"
-    
-    except requests.exceptions.HTTPError as http_err:
-        return f"HTTP error occurred: {http_err}"
-    except requests.exceptions.ConnectionError as conn_err:
-        return f"Connection error occurred: {conn_err}"
-    except requests.exceptions.Timeout as timeout_err:
-        return f"Timeout error occurred: {timeout_err}"
-    except requests.exceptions.RequestException as req_err:
-        return f"An error occurred: {req_err}"
+        return DOWNLOAD_MESSAGES[fetch_file(sourceFileUrl, saveFilePath, session, chunkSize, rangeWorkers, rangeSize)].format(saveFilePath)
     except Exception as err:
-        return f"An unexpected error occurred: {err}"
+        return describe_download_error(err)
 
-# Function to read jsonl File
+# Function to download the source file of a config before its ETL
 """
-    :param filePath
-    :return: Array of json object
+    :param config: config object, or the config of one source
+    :param session: requests.Session
+    :return: 'downloaded' or 'not_modified', a failed download raises ValueError so that no ETL runs on a stale or missing file
 """
-def read_json_file(filePath):
-    data = []
-    with open(filePath, 'r', encoding='utf-8') as file:
-        for line in file:
+def download_source_file(config, session):
+    saveFilePath = config['saveFilePath']
+    try:
+        status = fetch_file(config['sourceFileUrl'], saveFilePath, session, config.get('downloadChunkSize', 8192), config.get('downloadWorkers', 1),
+                            config.get('downloadRangeSize', 16 * 1024 * 1024))
+    except Exception as err:
+        raise ValueError(f"{describe_download_error(err)}. The ETL of '{saveFilePath}' is skipped.") from err
+    print(DOWNLOAD_MESSAGES[status].format(saveFilePath))
+    return status
+
+# Function to stream the lines of a remote file while it is still downloading
+# A background thread reads the response (and optionally tees it to disk) into a bounded queue,
+# so parsing the first lines overlaps with downloading the rest of the file.
+"""
+    :param response: streamed requests response
+    :param chunkSize: size of the chunks read from the response
+    :param teeFilePath: file the body is copied to, written as <teeFilePath>.tmp and renamed once complete
+    :param queueSize: number of chunks buffered between the download thread and the parser
+    :return: generator of lines as bytes
+"""
+def iter_response_lines(response, chunkSize=8192, teeFilePath=None, queueSize=64):
+    chunks = queue.Queue(maxsize=queueSize)
+    # Sentinel marking the end of the body
+    done = object()
+    stop = threading.Event()
+
+    def download():
+        tee = None
+        try:
+            tee = open(teeFilePath + '.tmp', 'wb') if teeFilePath else None
+            for chunk in response.iter_content(chunk_size=chunkSize):
+                if stop.is_set():
+                    break
+                if chunk:
+                    if tee:
+                        tee.write(chunk)
+                    chunks.put(chunk)
+            else:
+                if tee:
+                    tee.close()
+                    os.replace(teeFilePath + '.tmp', teeFilePath)
+                chunks.put(done)
+                return
+        except Exception as err:
+            chunks.put(err)
+        # Incomplete copies are never left next to the cached file
+        if tee:
+            tee.close()
+            if os.path.exists(teeFilePath + '.tmp'):
+                os.remove(teeFilePath + '.tmp')
+
+    thread = threading.Thread(target=download, daemon=True)
+    thread.start()
+    try:
+        buffer = b''
+        while True:
+            chunk = chunks.get()
+            if chunk is done:
+                break
+            if isinstance(chunk, Exception):
+                raise chunk
+            lines = (buffer + chunk).split(b'\n')
+            buffer = lines.pop()
+            yield from lines
+        if buffer:
+            yield buffer
+    finally:
+        # Stop the download thread and unblock it if the consumer stops early
+        stop.set()
+        response.close()
+        while thread.is_alive():
             try:
-                # Parse each line as a JSON object
-                json_obj = json.loads(line.strip())
+                chunks.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+# Function to parse one line of a jsonl File
+"""
+    :param line
+    :return: cleaned json object, or None if the line could not be decoded
+"""
+def parse_json_line(line):
+    try:
+        # Parse each line as a JSON object
+        json_obj = json.loads(line.strip())
+
+        # Remove new line characters from all string fields
+        return {key: (value.replace('\n', ' ') if isinstance(value, str) else value)
+                    for key, value in json_obj.items()}
+    except json.JSONDecodeError as e:
+        print(f"Error decoding JSON on line: {line.strip()}")
+        print(f"Error: {e}")
+        return None
+
+# Fields the pipeline itself reads, they are always kept when records are projected to a subset of fields
+PIPELINE_FIELDS = ('ingredients', 'cookTime', 'prepTime')
 
-                # Remove new line characters from all string fields
-                cleaned_JsonObj = {key: (value.replace('\n', ' ') if isinstance(value, str) else value)
-                            for key, value in json_obj.items()}
+# Function to convert a value returned by the simdjson parser to plain python objects
+"""
+    :param value: simdjson Object, Array or scalar
+    :return: dict, list or scalar
+"""
+def simdjson_to_python(value):
+    if isinstance(value, simdjson.Object):
+        return value.as_dict()
+    if isinstance(value, simdjson.Array):
+        return value.as_list()
+    return value
+
+# Function to pick the JSON decoding backend
+# orjson is preferred, then simdjson, the standard library json module is the fallback
+"""
+    :param backend: 'auto', 'orjson', 'simdjson' or 'json'
+    :param fields: keys to materialize, None for all of them
+    :return: (backend name, function decoding one line to a dict)
+"""
+def get_json_decoder(backend='auto', fields=None):
+    if backend in ('auto', 'orjson') and orjson is not None:
+        return 'orjson', orjson.loads
+    if backend in ('auto', 'simdjson') and simdjson is not None:
+        parser = simdjson.Parser()
+
+        # simdjson parses lazily, only the projected fields are turned into python objects
+        def loads(line):
+            try:
+                document = parser.parse(line.encode('utf-8') if isinstance(line, str) else line)
+                if fields is None:
+                    return document.as_dict()
+                return {key: simdjson_to_python(document[key]) for key in document.keys() if key in fields}
+            except RuntimeError as e:
+                raise ValueError(str(e)) from e
+        return 'simdjson', loads
+    if backend not in ('auto', 'json'):
+        raise ValueError(f"JSON backend '{backend}' is not installed")
+    return 'json', json.loads
 
-                data.append(cleaned_JsonObj)
-            except json.JSONDecodeError as e:
+# Function to decode one batch of jsonl lines
+# orjson and json decode the whole batch as one JSON array, a batch with a bad line is decoded line by line
+"""
+    :param batch: list of lines as str, utf-8 bytes or memoryview
+    :param name: backend name from get_json_decoder
+    :param loads: decoding function from get_json_decoder
+    :return: list of json objects, bad lines are reported and skipped
+"""
+def decode_json_batch(batch, name, loads):
+    records = None
+    if name != 'simdjson':
+        if isinstance(batch[0], str):
+            payload = '[' + ','.join(batch) + ']'
+        else:
+            payload = b'[' + b','.join(batch) + b']'
+        try:
+            records = loads(payload)
+        except ValueError:
+            records = None
+        # A line holding something else than one object shifts the array, decode it line by line
+        if records is not None and (len(records) != len(batch) or not all(isinstance(record, dict) for record in records)):
+            records = None
+    if records is None:
+        records = []
+        for line in batch:
+            if isinstance(line, memoryview):
+                line = line.tobytes()
+            try:
+                records.append(loads(line.strip()))
+            except ValueError as e:
                 print(f"Error decoding JSON on line: {line.strip()}")
                 print(f"Error: {e}")
-    return data
+    return records
 
-# Function to extract recipes with "Chilies" or its variants
-# Regular expression pattern to match "Chilies", "Chiles", "Chili", "Chile" (case insensitive)
+# Function to decode jsonl lines in batches without cleaning them
+# String values are not cleaned here, see clean_newlines.
+"""
+    :param lines: iterable of lines as str, utf-8 bytes or memoryview
+    :param backend: 'auto', 'orjson', 'simdjson' or 'json'
+    :param fields: pass-through keys to keep besides PIPELINE_FIELDS, None keeps all of them
+    :param batchSize: number of lines decoded at once
+    :return: generator of json objects
+"""
+def iter_decoded_records(lines, backend='auto', fields=None, batchSize=1000):
+    fields = None if fields is None else set(fields) | set(PIPELINE_FIELDS)
+    name, loads = get_json_decoder(backend, fields)
+
+    batches = iter_chunks(lines, batchSize)
+    while True:
+        with track_stage('parse') as counts:
+            batch = next(batches, None)
+            if batch is None:
+                break
+            records = decode_json_batch(batch, name, loads)
+            if fields is not None and name != 'simdjson':
+                records = [{key: value for key, value in record.items() if key in fields} for record in records]
+            counts['rowsIn'], counts['rowsOut'] = len(batch), len(records)
+        yield from records
+
+# Function to lazily parse jsonl lines
+"""
+    :param lines: iterable of lines as str or utf-8 bytes
+    :return: generator of cleaned json objects
+"""
+def iter_json_lines(lines):
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        json_obj = parse_json_line(line)
+        if json_obj is not None:
+            yield json_obj
+
+# Function to lazily read jsonl File
+"""
+    :param filePath
+    :return: generator of cleaned json objects, one line is held in memory at a time
+"""
+def iter_json_file(filePath):
+    with open(filePath, 'r', encoding='utf-8') as file:
+        yield from iter_json_lines(file)
+
+# Function to read jsonl File
+"""
+    :param filePath
+    :return: Array of json object
+"""
+def read_json_file(filePath):
+    return list(iter_json_file(filePath))
+
+# Regular expression pattern to match "Chilies", "Chiles", "Chili", "Chile" (case insensitive), compiled once at import
 """
-    :param jsonData
     Explanation for Regex:
     \b: Word boundary ensures that the match occurs at the start and end of a word, so it doesn't match within other words.
     Chil: Matches the common prefix "Chil" in all the words.
-    (l|e)?: Matches an optional "l" or "e." This handles variations like "Chile" and "Chille."
-    (i|e)?: Matches an optional "i" or "e." This handles variations like "Chilli" and "Chille."
+    (?:l|e)?: Matches an optional "l" or "e." This handles variations like "Chile" and "Chille."
+    (?:i|e)?: Matches an optional "i" or "e." This handles variations like "Chilli" and "Chille."
+    The groups are non-capturing, so the pattern can be combined with others by build_ingredient_matcher.
     s?: Matches an optional "s." This handles the plural forms like "Chiles" and "Chilles."
     \b: Another word boundary to ensure the match ends at the end of the word.
 """
-def extract_chilies_recipes(jsonData):
-    chilies_recipes = []
-    pattern = re.compile(r'\bChil(l|e)?(i|e)?s?\b', re.IGNORECASE)
+CHILI_PATTERN = re.compile(r'\bChil(?:l|e)?(?:i|e)?s?\b', re.IGNORECASE)
+
+# Every match of CHILI_PATTERN contains this literal once lowercased, most recipes are rejected by a substring check
+# without running the regex. The regex also matches the Turkish dotted and dotless I as an "i", which lowercase to
+# something else, so text containing either one always goes to the regex.
+CHILI_PREFILTER = 'chil'
+CHILI_PREFILTER_EXCEPTIONS = ('\u0130', '\u0131')
 
+# Function to check if an ingredients text contains "Chilies" or its variants
+"""
+    :param ingredients: ingredients string
+    :return: True if CHILI_PATTERN matches
+"""
+def has_chilies(ingredients):
+    if CHILI_PREFILTER not in ingredients.lower() and (ingredients.isascii() or not any(character in ingredients for character in CHILI_PREFILTER_EXCEPTIONS)):
+        return False
+    return CHILI_PATTERN.search(ingredients) is not None
+
+# Generator to extract recipes with "Chilies" or its variants, works on any iterable of recipes
+"""
+    :param jsonData
+    :return: generator of the recipes whose ingredients match CHILI_PATTERN
+"""
+def iter_chilies_recipes(jsonData):
     for recipe in jsonData:
-        ingredients = recipe.get('ingredients', []) 
+        ingredients = recipe.get('ingredients', [])
         # Ensure ingredients are processed as a list of strings
         if isinstance(ingredients, str):
             # Search directly within the ingredients string
-            if pattern.search(ingredients):
-                chilies_recipes.append(recipe)
+            if has_chilies(ingredients):
+                yield recipe
         elif isinstance(ingredients, list):
-            # Check each ingredient if ingredients is a list
-            if any(pattern.search(str(ingredient)) for ingredient in ingredients if isinstance(ingredient, str)):
-                chilies_recipes.append(recipe)
-    return chilies_recipes
+            # Ingredients of a list are searched at once, a new line keeps the word boundaries of every ingredient
+            if has_chilies('\n'.join(ingredient for ingredient in ingredients if isinstance(ingredient, str))):
+                yield recipe
+
+# Function to hash the identity of a recipe for de-duplication
+# Without a key the whole recipe is hashed, with new lines cleaned the way clean_newlines does.
+# The built-in hash of a string changes with every process, a hash persisted between runs has to be stable.
+"""
+    :param recipe
+    :param dedupeKey: field identifying a recipe, e.g. 'url', None to compare whole recipes
+    :param stable: return a blake2b hex digest that is the same in every process, instead of the faster built-in hash
+    :return: hash, None when the recipe has no dedupeKey
+"""
+def get_recipe_hash(recipe, dedupeKey=None, stable=False):
+    if dedupeKey is not None:
+        if recipe.get(dedupeKey) is None:
+            return None
+        identity = str(recipe[dedupeKey])
+    else:
+        # Missing and null fields are both empty in the csv, so both are left out of the hash
+        identity = tuple(sorted((key, value.replace('\n', ' ') if isinstance(value, str) else value)
+                                for key, value in recipe.items() if value is not None))
+    if stable:
+        text = identity if isinstance(identity, str) else json.dumps(identity, sort_keys=True, default=str)
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+    try:
+        return hash(identity)
+    except TypeError:
+        # Lists and objects are not hashable, they are compared on their JSON text
+        return hash(json.dumps(identity, sort_keys=True, default=str))
+
+# Function to drop duplicate recipes while they are read, so that duplicates never reach pandas
+# Only one hash per kept recipe is held in memory. The averages are therefore computed over unique recipes, the
+# original script averaged before dropping duplicates, so a duplicated recipe no longer weighs twice in Results.csv.
+"""
+    :param recipes: iterable of recipes
+    :param dedupeKey: field identifying a recipe, see get_recipe_hash
+    :param seen: set of the stable hashes of recipes kept by previous runs, updated in place, None to dedupe within this call
+    :param added: list the hashes of the recipes kept by this call are appended to, None to not collect them
+    :return: generator of the first occurrence of every recipe, recipes without dedupeKey are all kept
+"""
+def iter_unique_recipes(recipes, dedupeKey=None, seen=None, added=None):
+    stable = seen is not None
+    seen = set() if seen is None else seen
+    for recipe in recipes:
+        recipe_hash = get_recipe_hash(recipe, dedupeKey, stable)
+        if recipe_hash is None:
+            yield recipe
+        elif recipe_hash not in seen:
+            seen.add(recipe_hash)
+            if added is not None:
+                added.append(recipe_hash)
+            yield recipe
+
+# Function to extract recipes with "Chilies" or its variants into a list
+"""
+    :param jsonData
+    :return: Array of json object
+"""
+def extract_chilies_recipes(jsonData):
+    return list(iter_chilies_recipes(jsonData))
+
+# Default ingredient patterns of the matcher engine, a tag maps to a case insensitive regex and an optional
+# lowercase literal that every match contains. The literal is a cheap prefilter: the regex only runs on
+# ingredients that contain the literal of at least one tag.
+DEFAULT_INGREDIENT_PATTERNS = {
+    'chilies': {'pattern': CHILI_PATTERN.pattern, 'prefilter': CHILI_PREFILTER}
+}
+
+# Function to build a matcher that finds every configured ingredient in a single scan
+# All patterns are combined into one alternation with a named group per tag, so an ingredients
+# string is scanned once no matter how many tags are configured. Matches of the alternation do not
+# overlap, so a tag whose words are part of the match of another tag ("onion" in "green onions") is
+# searched again on its own, only when the scan found something and the prefilter of the tag hit.
+"""
+    :param ingredientPatterns: dict of tag -> {'pattern': regex, 'prefilter': lowercase literal (optional)}
+    :return: function taking the ingredients (string or list of strings) and returning the set of matched tags
+"""
+def build_ingredient_matcher(ingredientPatterns=None):
+    ingredientPatterns = ingredientPatterns or DEFAULT_INGREDIENT_PATTERNS
+    tags = list(ingredientPatterns)
+    patterns = []
+    for tag in tags:
+        try:
+            pattern = re.compile(ingredientPatterns[tag]['pattern'], re.IGNORECASE)
+        except re.error as err:
+            raise ValueError(f"Invalid pattern of ingredient '{tag}': {err}") from err
+        # Groups of the pattern would be renumbered in the combined regex and break its backreferences
+        if pattern.groups:
+            raise ValueError(f"Pattern of ingredient '{tag}' has capturing groups, use non-capturing groups (?:...) without backreferences")
+        patterns.append(pattern)
+    # Tags may not be valid group names, groups are numbered and mapped back to the tags
+    try:
+        combined = re.compile('|'.join(f"(?P<tag{index}>{pattern.pattern})" for index, pattern in enumerate(patterns)), re.IGNORECASE)
+    except re.error as err:
+        raise ValueError(f"Ingredient patterns cannot be combined, e.g. because of inline flags: {err}") from err
+    group_tags = {f"tag{index}": tag for index, tag in enumerate(tags)}
+    prefilters = [ingredientPatterns[tag].get('prefilter') for tag in tags]
+    always_scan = any(prefilter is None for prefilter in prefilters)
+
+    def match(ingredients):
+        if isinstance(ingredients, list):
+            ingredients = '\n'.join(ingredient for ingredient in ingredients if isinstance(ingredient, str))
+        elif not isinstance(ingredients, str):
+            return set()
+        if not always_scan:
+            lowered = ingredients.lower()
+            candidates = [index for index, prefilter in enumerate(prefilters) if prefilter in lowered]
+            if not candidates:
+                return set()
+        else:
+            candidates = range(len(tags))
+
+        found = set()
+        for found_match in combined.finditer(ingredients):
+            found.add(group_tags[found_match.lastgroup])
+            if len(found) == len(candidates):
+                return found
+        # Without any match no tag can match, otherwise a missing tag may be hidden by an overlapping match
+        if found:
+            for index in candidates:
+                if tags[index] not in found and patterns[index].search(ingredients):
+                    found.add(tags[index])
+        return found
+
+    return match
+
+# Generator to tag recipes with every ingredient they contain, recipes without any are dropped
+"""
+    :param jsonData: iterable of recipes
+    :param matcher: function from build_ingredient_matcher
+    :return: generator of (recipe, set of tags)
+"""
+def iter_tagged_recipes(jsonData, matcher):
+    for recipe in jsonData:
+        tags = matcher(recipe.get('ingredients', []))
+        if tags:
+            yield recipe, tags
 
 # Function to converts PT duration to minutes 
 """
@@ -123,82 +900,1893 @@ def convert_duration_to_minutes(pt_duration):
     minutes = seconds / 60
     return minutes
 
+# Regular expression for the ISO 8601 durations found in recipe feeds, e.g. "PT1H30M" or "P1DT2H"
+# Anything else (weeks, years, signs, "PT") is handed to convert_duration_to_minutes, so isodate stays the reference
+DURATION_PATTERN = re.compile(
+    r'^P(?!$)(?:(?P<days>\d+(?:[.,]\d+)?)D)?'
+    r'(?:T(?=\d)(?:(?P<hours>\d+(?:[.,]\d+)?)H)?(?:(?P<minutes>\d+(?:[.,]\d+)?)M)?(?:(?P<seconds>\d+(?:[.,]\d+)?)S)?)?$'
+)
+DURATION_SECONDS = {'days': 86400, 'hours': 3600, 'minutes': 60, 'seconds': 1}
+
+# Bounded memo of parsed durations, shared by the cook and prep time conversions of every chunk of the run
+# Invalid durations are cached as NaN, so they are not parsed again either. The least recently used value is evicted first.
+DURATION_MEMO = {'maxSize': 10000, 'minutes': collections.OrderedDict()}
+
+# Function to set the size of the duration memo, the memo is emptied
+"""
+    :param maxSize: number of distinct durations kept, 0 disables the memo
+"""
+def configure_duration_memo(maxSize=10000):
+    DURATION_MEMO['maxSize'] = maxSize
+    DURATION_MEMO['minutes'].clear()
+
+# Function to convert a whole column of PT durations to minutes
+# Every distinct value is looked up in DURATION_MEMO or parsed once with DURATION_PATTERN, the result is broadcast back to the rows
+"""
+    :param durations: Series (or array-like) of ISO 8601 duration strings
+    :param errors: 'raise' to raise a ValueError listing the invalid rows, 'coerce' to return NaN for them
+    :return: (float64 array of minutes, Index of the invalid rows)
+"""
+def convert_durations_to_minutes(durations, errors='raise'):
+    durations = pd.Series(durations, dtype=object)
+    # codes are -1 for missing values
+    codes, uniques = pd.factorize(durations)
+    uniques = pd.Series(uniques, dtype=object)
+    unique_minutes = np.full(len(uniques), np.nan)
+
+    # Durations parsed by earlier chunks, a cached NaN is an invalid duration
+    memo = DURATION_MEMO['minutes']
+    is_cached = np.zeros(len(uniques), dtype=bool)
+    for position, value in enumerate(uniques):
+        if value in memo:
+            memo.move_to_end(value)
+            unique_minutes[position] = memo[value]
+            is_cached[position] = True
+    count_metric('durationMemoHits', int(is_cached.sum()))
+    count_metric('durationMemoMisses', int(len(uniques) - is_cached.sum()))
+
+    is_string = uniques.map(lambda value: isinstance(value, str)).to_numpy(dtype=bool) & ~is_cached
+    parts = uniques[is_string].str.extract(DURATION_PATTERN)
+    matched = parts.notna().any(axis=1)
+    seconds = sum(pd.to_numeric(parts[unit].str.replace(',', '.', regex=False)).fillna(0) * factor
+                  for unit, factor in DURATION_SECONDS.items())
+    unique_minutes[parts.index[matched]] = (seconds[matched] / 60).to_numpy()
+
+    # Empty strings and the durations the pattern does not cover go through the scalar parser
+    for position in np.flatnonzero(np.isnan(unique_minutes) & ~is_cached):
+        try:
+            unique_minutes[position] = convert_duration_to_minutes(uniques[position])
+        except ValueError:
+            pass
+
+    if DURATION_MEMO['maxSize'] > 0:
+        for position in np.flatnonzero(~is_cached):
+            memo[uniques[position]] = unique_minutes[position]
+        while len(memo) > DURATION_MEMO['maxSize']:
+            memo.popitem(last=False)
+
+    minutes = unique_minutes.take(codes)
+    minutes[codes == -1] = np.nan
+    invalid_rows = durations.index[np.isnan(minutes)]
+    if errors == 'raise' and len(invalid_rows) > 0:
+        raise ValueError(f"Invalid duration format in rows: {list(invalid_rows)}")
+    return minutes, invalid_rows
+
+# Default difficulty thresholds in minutes, can be overridden with "difficultyThresholds" in config.json
+# total_time > hard is Hard, total_time >= medium is Medium, anything lower is Easy
+DEFAULT_DIFFICULTY_THRESHOLDS = {'hard': 60, 'medium': 30}
+
+# Function to read the difficulty thresholds from the config, a partial override keeps the default of the other threshold
+"""
+    :param config: config object
+    :return: dict with 'hard' and 'medium' minutes
+"""
+def get_difficulty_thresholds(config):
+    override = config.get('difficultyThresholds') or {}
+    unknown = [key for key in override if key not in DEFAULT_DIFFICULTY_THRESHOLDS]
+    if unknown:
+        raise ValueError(f"Unknown difficultyThresholds {', '.join(unknown)}, expected hard and medium")
+    thresholds = dict(DEFAULT_DIFFICULTY_THRESHOLDS, **override)
+    if any(isinstance(value, bool) or not isinstance(value, (int, float)) for value in thresholds.values()):
+        raise ValueError(f"difficultyThresholds must be numbers of minutes, got {thresholds}")
+    # Medium recipes are between the two thresholds, there would be none with medium above hard
+    if thresholds['medium'] > thresholds['hard']:
+        raise ValueError(f"difficultyThresholds medium ({thresholds['medium']}) must not be above hard ({thresholds['hard']})")
+    return thresholds
+
+# Difficulty levels in order, the categories of the difficulty column
+DIFFICULTY_LEVELS = ['Easy', 'Medium', 'Hard']
+
 # The function calculates difficulty of the cooking process
 """
     :param cook_time: int
     :param prep_time: int
+    :param thresholds: dict with 'hard' and 'medium' minutes, defaults to DEFAULT_DIFFICULTY_THRESHOLDS
     :return: difficulty: string
 """
-def calculate_difficulty(cookTime_minutes, prepTime_minutes):
+def calculate_difficulty(cookTime_minutes, prepTime_minutes, thresholds=None):
+    thresholds = thresholds or DEFAULT_DIFFICULTY_THRESHOLDS
     total_time = cookTime_minutes + prepTime_minutes
     if np.isnan(total_time):
         return 'Unknown Difficulty',total_time
-    elif total_time > 60:
+    elif total_time > thresholds['hard']:
         return 'Hard',total_time
-    elif total_time >= 30:
+    elif total_time >= thresholds['medium']:
         return 'Medium',total_time
     else:
         return 'Easy',total_time
 
-def main():
-    print("** Starting ETL process for Hello Fresh ** ",datetime.datetime.now())
-    # read config file
-    config = read_configs("/Users/sohansamant/Desktop/SohanSamant/hf_bi_python_exercise/recipes-etl/src/config.json")
+# The function calculates difficulty for whole columns of cook and prep times at once
+"""
+    :param cookTime_minutes: array-like of minutes
+    :param prepTime_minutes: array-like of minutes
+    :param thresholds: dict with 'hard' and 'medium' minutes, defaults to DEFAULT_DIFFICULTY_THRESHOLDS
+    :return: (array of difficulty strings, float64 array of total_time)
+"""
+def calculate_difficulty_columns(cookTime_minutes, prepTime_minutes, thresholds=None):
+    thresholds = thresholds or DEFAULT_DIFFICULTY_THRESHOLDS
+    total_time = np.asarray(cookTime_minutes, dtype=np.float64) + np.asarray(prepTime_minutes, dtype=np.float64)
+    # NaN compares False against every threshold, so it has to be the first condition
+    difficulty = np.select(
+        [np.isnan(total_time), total_time > thresholds['hard'], total_time >= thresholds['medium']],
+        ['Unknown Difficulty', 'Hard', 'Medium'],
+        default='Easy'
+    ).astype(object)
+    return difficulty, total_time
 
-    # URL of the file to download
-    sourceFileUrl = config.get('sourceFileUrl')
-    # Path where you want to save the downloaded file
-    saveFilePath = config.get('saveFilePath')
-    # output path
-    chileOutputFilePath = config.get('chileOutputFilePath')
-    # Results path
-    resultOutputFilePath = config.get('resultOutputFilePath')
+# Function to replace new line characters in the string columns of a dataframe
+# Cleaning happens when the output is written, so only recipes that are kept pay for it
+"""
+    :param recipesDF
+    :return: dataframe without new line characters in string values
+"""
+def clean_newlines(recipesDF):
+    for column in recipesDF.columns:
+        if not (pd.api.types.is_object_dtype(recipesDF[column]) or pd.api.types.is_string_dtype(recipesDF[column])):
+            continue
+        has_newline = recipesDF[column].str.contains('\n', regex=False, na=False).astype(bool)
+        if has_newline.any():
+            recipesDF.loc[has_newline, column] = recipesDF.loc[has_newline, column].str.replace('\n', ' ', regex=False)
+    return recipesDF
+
+# Helper columns added while classifying recipes, they are not part of the Chilies output
+HELPER_COLUMNS = ['prepTime_minutes', 'cookTime_minutes', 'total_time']
+
+# Dtype of the text columns of recipes, pyarrow-backed strings take a fraction of the memory of python string objects
+RECIPE_STRING_DTYPE = 'string[pyarrow]' if importlib.util.find_spec('pyarrow') is not None else None
+
+# Function to build the dataframe of a list of recipes with compact dtypes
+"""
+    :param recipes: list of recipes
+    :return: dataframe with pyarrow-backed string columns when pyarrow is installed
+"""
+def build_recipes_frame(recipes):
+    recipesDF = pd.DataFrame(recipes)
+    if RECIPE_STRING_DTYPE is None:
+        return recipesDF
+    # Columns that pandas already stores as strings are kept, python object columns are converted
+    for column in recipesDF.columns:
+        if pd.api.types.is_object_dtype(recipesDF[column]):
+            try:
+                recipesDF[column] = recipesDF[column].astype(RECIPE_STRING_DTYPE)
+            except (TypeError, ValueError):
+                pass
+    return recipesDF
+
+# Function to add the cookTime and prepTime in minutes to a dataframe of recipes
+"""
+    :param recipesDF: dataframe with cookTime and prepTime columns
+    :return: dataframe with cookTime_minutes and prepTime_minutes columns
+"""
+def add_duration_minutes(recipesDF):
+    # Parse durations and convert ISO time to minutes, invalid durations are reported and end up as unknown difficulty
+    for column in ['cookTime', 'prepTime']:
+        recipesDF[f'{column}_minutes'], invalid_rows = convert_durations_to_minutes(recipesDF[column], errors='coerce')
+        if len(invalid_rows) > 0:
+            print(f"Invalid {column} in {len(invalid_rows)} recipes: {recipesDF.loc[invalid_rows, column].unique().tolist()}")
+    return recipesDF
+
+# Function to add total time and difficulty to a dataframe of recipes with durations in minutes
+"""
+    :param recipesDF: dataframe with cookTime_minutes and prepTime_minutes columns
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :return: dataframe with categorical difficulty and total_time and float32 minutes, recipes with unknown difficulty are filtered out
+"""
+def add_difficulty(recipesDF, thresholds=None):
+    # Calculate difficulty on the whole columns at once instead of one apply call per row
+    difficulty, recipesDF['total_time'] = calculate_difficulty_columns(recipesDF['cookTime_minutes'], recipesDF['prepTime_minutes'], thresholds)
+    recipesDF['difficulty'] = pd.Categorical(difficulty, categories=DIFFICULTY_LEVELS + ['Unknown Difficulty'], ordered=True)
+
+    # Filtering out unknown difficulty level
+    recipesDF = recipesDF[recipesDF['difficulty'] != 'Unknown Difficulty']
+    # total_time stays float64 so that the averages are exact, the minutes are only kept for the outputs
+    return recipesDF.astype({'difficulty': pd.CategoricalDtype(DIFFICULTY_LEVELS, ordered=True),
+                             'cookTime_minutes': np.float32, 'prepTime_minutes': np.float32})
+
+# Function to add durations in minutes, total time and difficulty to a dataframe of recipes
+"""
+    :param recipesDF: dataframe with cookTime and prepTime columns
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :return: dataframe with helper columns and difficulty, recipes with unknown difficulty are filtered out
+"""
+def classify_recipes(recipesDF, thresholds=None):
+    return add_difficulty(add_duration_minutes(recipesDF), thresholds)
 
-    # Check if file already exist, download only if it doesn't exist
-    if os.path.isfile(saveFilePath):
-        print(f"The file '{saveFilePath}' already exists. No download needed.")
+# Percentiles of total_time written to the results file besides the average, e.g. [50, 95], none by default
+# Difficulty buckets only keep a sketch of their values when percentiles are set. A sketch holds the exact values
+# up to exactLimit values, then it becomes a histogram of binMinutes wide bins, so memory stays bounded.
+RESULT_PERCENTILES = {'percentiles': [], 'exactLimit': 1000, 'binMinutes': 1.0}
+
+# Function to set the percentiles written to the results file
+"""
+    :param percentiles: list of percentiles between 0 and 100, None or empty for the averages only
+    :param exactLimit: number of values per difficulty kept exactly before switching to a histogram
+    :param binMinutes: width of the histogram bins in minutes
+"""
+def configure_result_percentiles(percentiles=None, exactLimit=1000, binMinutes=1.0):
+    for percentile in percentiles or []:
+        if not 0 < percentile <= 100:
+            raise ValueError(f"Percentile {percentile} is not between 0 and 100")
+    if binMinutes <= 0:
+        raise ValueError("percentileBinMinutes must be positive")
+    RESULT_PERCENTILES.update(percentiles=list(percentiles or []), exactLimit=exactLimit, binMinutes=float(binMinutes))
+
+# Function to create an empty stats bucket of a difficulty
+"""
+    :return: bucket dict, with an empty sketch when percentiles are set
+"""
+def new_stats_bucket():
+    bucket = {'sum': 0.0, 'count': 0}
+    if RESULT_PERCENTILES['percentiles']:
+        bucket['sketch'] = {'values': []}
+    return bucket
+
+# Function to add total_time values to a sketch
+# Histogram bins are a dict of bin number to count, the numbers are strings so that a sketch survives a JSON round trip
+"""
+    :param sketch: {'values': list} in exact mode or {'bins': dict, 'binMinutes': float, 'min': float, 'max': float}
+    :param values: numpy array of minutes without NaN
+    :return: updated sketch
+"""
+def add_to_sketch(sketch, values):
+    if len(values) == 0:
+        return sketch
+    if 'values' in sketch:
+        if len(sketch['values']) + len(values) <= RESULT_PERCENTILES['exactLimit']:
+            sketch['values'].extend(values.tolist())
+            return sketch
+        # Too many values to keep, the exact values become the first counts of the histogram
+        values = np.concatenate([np.asarray(sketch.pop('values'), dtype=np.float64), values])
+        sketch.update(bins={}, binMinutes=RESULT_PERCENTILES['binMinutes'], min=float(values.min()), max=float(values.max()))
     else:
-        # Call the function to download the file
-        download_file(sourceFileUrl, saveFilePath)
-    
-    # Read file in dataframe and perform ETL
-    jsonData = read_json_file(saveFilePath) # This is returned as an array of objects
+        sketch['min'] = min(sketch['min'], float(values.min()))
+        sketch['max'] = max(sketch['max'], float(values.max()))
 
-    # Extract recipes with "Chilies" or its variants
-    recipes_with_chilies = extract_chilies_recipes(jsonData)
+    numbers, counts = np.unique(np.floor(values / sketch['binMinutes']).astype(np.int64), return_counts=True)
+    for number, count in zip(numbers.tolist(), counts.tolist()):
+        sketch['bins'][str(number)] = sketch['bins'].get(str(number), 0) + count
+    return sketch
 
-    # Convert to Dataframe
-    recipes_with_chiliesDF = pd.DataFrame(recipes_with_chilies)
+# Function to merge two sketches, e.g. of two shards or two increments
+"""
+    :param sketch: sketch updated in place when possible
+    :param otherSketch
+    :return: merged sketch
+"""
+def merge_sketches(sketch, otherSketch):
+    if 'values' in otherSketch:
+        return add_to_sketch(sketch, np.asarray(otherSketch['values'], dtype=np.float64))
+    if 'values' in sketch:
+        merged = {'bins': dict(otherSketch['bins']), 'binMinutes': otherSketch['binMinutes'], 'min': otherSketch['min'], 'max': otherSketch['max']}
+        return add_to_sketch(merged, np.asarray(sketch['values'], dtype=np.float64))
+    if sketch['binMinutes'] != otherSketch['binMinutes']:
+        raise ValueError(f"Cannot merge histograms of {sketch['binMinutes']} and {otherSketch['binMinutes']} minute bins")
+    for number, count in otherSketch['bins'].items():
+        sketch['bins'][number] = sketch['bins'].get(number, 0) + count
+    sketch['min'] = min(sketch['min'], otherSketch['min'])
+    sketch['max'] = max(sketch['max'], otherSketch['max'])
+    return sketch
 
-    # Proceeding further only if there is any data with recipes that has “Chilies” as one of the ingredients.
-    if not recipes_with_chiliesDF.empty:
+# Function to read a percentile from a sketch with the nearest rank method: the smallest value that has at least
+# percentile % of the values at or below it. A histogram answers with the lower edge of the bin of that value,
+# clipped to the smallest and largest value, which is exact for values on bin edges (whole minutes by default).
+"""
+    :param sketch
+    :param percentile: between 0 and 100
+    :param count: number of values in the sketch
+    :return: minutes
+"""
+def get_sketch_percentile(sketch, percentile, count):
+    rank = max(math.ceil(percentile * count / 100), 1)
+    if 'values' in sketch:
+        return sorted(sketch['values'])[rank - 1]
+    seen = 0
+    for number in sorted(sketch['bins'], key=int):
+        seen += sketch['bins'][number]
+        if seen >= rank:
+            return min(max(int(number) * sketch['binMinutes'], sketch['min']), sketch['max'])
+    return sketch['max']
 
-        # Parse durations and convert ISO time to minutes
-        recipes_with_chiliesDF['cookTime_minutes'] = recipes_with_chiliesDF['cookTime'].apply(convert_duration_to_minutes)
-        recipes_with_chiliesDF['prepTime_minutes'] = recipes_with_chiliesDF['prepTime'].apply(convert_duration_to_minutes)
+# Function to name the results row of a percentile
+"""
+    :param percentile
+    :return: remark, e.g. median_total_time or p95_total_time
+"""
+def get_percentile_remark(percentile):
+    return 'median_total_time' if percentile == 50 else f"p{percentile:g}_total_time"
 
-        # Calculate difficulty: apply(lambda row) apply function to each row of dataframe.
-        # We can use the apply() function to apply the lambda function to both rows and columns of a dataframe. 
-        # If the axis argument in the apply() function is 0, then the lambda function gets applied to each column, and if 1, then the function gets applied to each row.
-        recipes_with_chiliesDF['difficulty'], recipes_with_chiliesDF['total_time']= zip(*recipes_with_chiliesDF.apply(lambda row: calculate_difficulty(row['cookTime_minutes'], row['prepTime_minutes']),axis=1))
+# Function to add the total_time sum and count per difficulty of a dataframe to running stats
+# Sums and counts are kept instead of averages so that stats of several chunks can be merged exactly
+"""
+    :param stats: dict of difficulty -> {'sum': float, 'count': int, 'sketch': dict (when percentiles are set)}
+    :param recipesDF: classified dataframe
+    :return: updated stats
+"""
+def update_difficulty_stats(stats, recipesDF):
+    grouped = recipesDF.groupby('difficulty', observed=True)['total_time'].agg(['sum', 'count'])
+    for difficulty, row in grouped.iterrows():
+        bucket = stats.setdefault(difficulty, new_stats_bucket())
+        bucket['sum'] += float(row['sum'])
+        bucket['count'] += int(row['count'])
+    if RESULT_PERCENTILES['percentiles']:
+        for difficulty, total_time in recipesDF.groupby('difficulty', observed=True)['total_time']:
+            # A bucket created before percentiles were set has no sketch, its percentiles would miss values
+            if 'sketch' in stats[difficulty]:
+                add_to_sketch(stats[difficulty]['sketch'], total_time.dropna().to_numpy(dtype=np.float64))
+    return stats
 
-        # Get average of total_time grouped by difficulty level
-        # First filtering out unknown difficulty level
-        recipes_with_chiliesDF=recipes_with_chiliesDF[recipes_with_chiliesDF['difficulty'] != 'Unknown Difficulty']
+# Function to merge two running stats dicts
+"""
+    :param stats
+    :param otherStats
+    :return: merged stats
+"""
+def merge_difficulty_stats(stats, otherStats):
+    for difficulty, other in otherStats.items():
+        bucket = stats.setdefault(difficulty, new_stats_bucket())
+        bucket['sum'] += other['sum']
+        bucket['count'] += other['count']
+        # The merged bucket only has a sketch when both sides cover all of their values
+        if 'sketch' in bucket and 'sketch' in other:
+            bucket['sketch'] = merge_sketches(bucket['sketch'], other['sketch'])
+        else:
+            bucket.pop('sketch', None)
+    return stats
 
-        # Group by difficulty and calculate the average total_time
-        average_total_time_by_difficulty = recipes_with_chiliesDF.groupby('difficulty')['total_time'].mean().reset_index()
-        average_total_time_by_difficulty['remark'] = 'average_total_time'
-
-        # Reorder the columns
-        results_DF = average_total_time_by_difficulty[['difficulty', 'remark', 'total_time']]
-        # Write the results to a CSV file with a '|' separator
-        results_DF.to_csv(resultOutputFilePath, sep='|', index=False, header=False)
-
-        # Save dataframe to csv
-        recipes_with_chiliesDF = recipes_with_chiliesDF.drop(columns=['prepTime_minutes', 'cookTime_minutes', 'total_time']).drop_duplicates()
-        # Write Chiles data to csv
-        recipes_with_chiliesDF.to_csv(chileOutputFilePath, sep='|',index=False)
+# Number of rows formatted and written to a csv at once, so a large dataframe is never formatted as one string
+CSV_BATCH_ROWS = 10000
+
+# Function to write a dataframe to an open csv of a writer state, the file is opened as <outputFilePath>.tmp by the first call
+# An existing csv is appended to in place instead, its size is kept so that close_csv_writer can cut off the new rows
+"""
+    :param df: dataframe with the columns of the csv
+    :param outputFilePath
+    :param writerState: state from new_writer_state, updated in place
+    :param header: write the header with the first rows
+"""
+def write_csv_chunk(df, outputFilePath, writerState, header=True):
+    if writerState['file'] is None:
+        writerState['outputFilePath'] = outputFilePath
+        if writerState['append']:
+            writerState['appendSize'] = os.path.getsize(outputFilePath)
+            writerState['file'] = open(outputFilePath, 'a', encoding='utf-8', newline='')
+        else:
+            writerState['file'] = open(outputFilePath + '.tmp', 'w', encoding='utf-8', newline='')
+    df.to_csv(writerState['file'], sep='|', index=False, header=header and not writerState['headerWritten'], chunksize=CSV_BATCH_ROWS)
+    writerState['headerWritten'] = True
+
+# Function to finish the csv of a writer state
+# The temporary file is renamed over the output file, so readers see either the previous file or the complete new one.
+# In incremental mode the rows were appended to the csv itself, a failed run truncates it back to its previous size.
+"""
+    :param writerState: state from new_writer_state
+    :param commit: False to discard the rows written so far
+"""
+def close_csv_writer(writerState, commit=True):
+    file = writerState['file']
+    if file is None:
+        return
+    file.close()
+    writerState['file'] = None
+    if writerState['append']:
+        if not commit:
+            os.truncate(writerState['outputFilePath'], writerState['appendSize'])
+        return
+    tmpFilePath = writerState['outputFilePath'] + '.tmp'
+    if not commit:
+        os.remove(tmpFilePath)
+    else:
+        os.replace(tmpFilePath, writerState['outputFilePath'])
+
+# Function to write a whole dataframe to a csv in batches, the file is replaced atomically
+"""
+    :param df: dataframe with the columns of the csv
+    :param outputFilePath
+    :param header: write the header line
+"""
+def write_csv_file(df, outputFilePath, header=True):
+    writerState = new_writer_state()
+    try:
+        write_csv_chunk(df, outputFilePath, writerState, header)
+    except BaseException:
+        close_csv_writer(writerState, commit=False)
+        raise
+    close_csv_writer(writerState)
+
+# Function to write the average total_time per difficulty to the results file
+"""
+    :param stats: dict of difficulty -> {'sum': float, 'count': int}
+    :param resultOutputFilePath
+    :param columnarOptions: options from get_columnar_options, None to write the csv only
+"""
+def write_results(stats, resultOutputFilePath, columnarOptions=None):
+    with track_stage('write_results', len(stats)) as counts:
+        results_DF = write_results_file(stats, resultOutputFilePath)
+        if columnarOptions is not None:
+            write_results_columnar(results_DF, resultOutputFilePath, columnarOptions)
+        counts['rowsOut'] = len(stats)
+
+# Function to write the results rows of the running stats
+"""
+    :param stats: dict of difficulty -> {'sum': float, 'count': int}
+    :param resultOutputFilePath
+    :return: results dataframe
+"""
+def write_results_file(stats, resultOutputFilePath):
+    rows = []
+    for difficulty, bucket in sorted(stats.items()):
+        if bucket['count'] > 0:
+            rows.append([difficulty, 'average_total_time', bucket['sum'] / bucket['count']])
+            # Counts and percentiles are extra rows in the same difficulty|remark|value format
+            if RESULT_PERCENTILES['percentiles'] and 'sketch' in bucket:
+                rows.append([difficulty, 'count', bucket['count']])
+                rows += [[difficulty, get_percentile_remark(percentile), get_sketch_percentile(bucket['sketch'], percentile, bucket['count'])]
+                         for percentile in RESULT_PERCENTILES['percentiles']]
+    # Values are kept as objects so that a count is written as an integer
+    results_DF = pd.DataFrame({'difficulty': [row[0] for row in rows], 'remark': [row[1] for row in rows],
+                               'total_time': pd.Series([row[2] for row in rows], dtype=object)})
+    # Write the results to a CSV file with a '|' separator
+    write_csv_file(results_DF, resultOutputFilePath, header=False)
+    return results_DF
+
+# File extension of every columnar output format
+COLUMNAR_EXTENSIONS = {'parquet': '.parquet', 'feather': '.feather'}
+
+# Function to import pyarrow, it is only needed when a columnar output format or the parse cache is configured
+"""
+    :param feature: name of the option that needs pyarrow, used in the error message
+    :return: pyarrow module
+"""
+def import_pyarrow(feature="outputFormat 'parquet' and 'feather'"):
+    try:
+        pyarrow = importlib.import_module('pyarrow')
+        importlib.import_module('pyarrow.dataset')
+        importlib.import_module('pyarrow.parquet')
+    except ImportError:
+        raise ValueError(f"{feature} needs pyarrow, install it with 'pip3 install pyarrow'")
+    return pyarrow
+
+# Function to read the columnar output options from the config
+"""
+    :param config: config object
+    :return: dict of format, compression and partitionByDifficulty, None when only csv files are written
+"""
+def get_columnar_options(config):
+    outputFormat = config.get('outputFormat', 'csv')
+    if outputFormat == 'csv':
+        return None
+    if outputFormat not in COLUMNAR_EXTENSIONS:
+        raise ValueError(f"Unknown outputFormat '{outputFormat}', expected one of csv, {', '.join(COLUMNAR_EXTENSIONS)}")
+    # Fail before any work is done when pyarrow is missing, it is only imported once a columnar file is written
+    # so that a run skipped by is_run_up_to_date does not load it
+    if importlib.util.find_spec('pyarrow') is None:
+        raise ValueError(f"outputFormat '{outputFormat}' needs pyarrow, install it with 'pip3 install pyarrow'")
+    return {'format': outputFormat, 'compression': config.get('outputCompression', 'zstd'),
+            'partitionByDifficulty': config.get('partitionByDifficulty', False)}
+
+# Function to get the path of the columnar output written next to a csv
+"""
+    :param csvFilePath
+    :param columnarOptions: options from get_columnar_options
+    :return: path with the extension of the columnar format
+"""
+def get_columnar_path(csvFilePath, columnarOptions):
+    return os.path.splitext(csvFilePath)[0] + COLUMNAR_EXTENSIONS[columnarOptions['format']]
+
+# Function to give a dataframe of classified recipes the dtypes of the columnar outputs
+"""
+    :param recipesDF: classified dataframe, helper columns included
+    :return: dataframe with datetime datePublished and categorical difficulty
+"""
+def to_columnar_frame(recipesDF):
+    columnarDF = recipesDF.copy()
+    if 'datePublished' in columnarDF.columns:
+        columnarDF['datePublished'] = pd.to_datetime(columnarDF['datePublished'], format='ISO8601', errors='coerce')
+    if 'difficulty' in columnarDF.columns:
+        columnarDF['difficulty'] = pd.Categorical(columnarDF['difficulty'], categories=DIFFICULTY_LEVELS, ordered=True)
+    return columnarDF
+
+# Function to create the state of a columnar output written chunk by chunk
+# Partitioned and appended outputs are datasets, a directory that every chunk adds a file to.
+# Other outputs are a single file, its row groups (parquet) or record batches (feather) are written chunk by chunk.
+"""
+    :param columnarPath
+    :param columnarOptions: options from get_columnar_options
+    :param append: add files to an existing dataset instead of replacing it
+    :param dataset: write a dataset even when it is not partitioned, so that later runs can append to it
+    :return: columnar state dict
+"""
+def new_columnar_state(columnarPath, columnarOptions, append=False, dataset=False):
+    return {'path': columnarPath, 'options': columnarOptions, 'append': append,
+            'dataset': dataset or columnarOptions['partitionByDifficulty'], 'schema': None, 'writer': None,
+            'runId': uuid.uuid4().hex[:8], 'parts': 0}
+
+# Function to remove a previous columnar output, a file or a dataset directory
+"""
+    :param columnarPath
+"""
+def remove_columnar_output(columnarPath):
+    if os.path.isdir(columnarPath):
+        shutil.rmtree(columnarPath)
+    elif os.path.exists(columnarPath):
+        os.remove(columnarPath)
+
+# Function to write one chunk of classified recipes to a columnar output
+"""
+    :param recipesDF: classified dataframe, helper columns included
+    :param columnarState: state from new_columnar_state, updated in place
+"""
+def write_columnar_chunk(recipesDF, columnarState):
+    pyarrow = import_pyarrow()
+    options = columnarState['options']
+    table = pyarrow.Table.from_pandas(to_columnar_frame(recipesDF), preserve_index=False)
+
+    # The schema is taken from the first chunk, later chunks are cast to it
+    if columnarState['schema'] is None:
+        # Columns without any value in the first chunk are typed as strings instead of nulls
+        columnarState['schema'] = pyarrow.schema([field.with_type(pyarrow.string()) if pyarrow.types.is_null(field.type) else field
+                                                  for field in table.schema])
+        if not columnarState['append']:
+            remove_columnar_output(columnarState['path'])
+    table = table.select(columnarState['schema'].names).cast(columnarState['schema'])
+
+    if columnarState['dataset']:
+        if options['format'] == 'parquet':
+            fileFormat = pyarrow.dataset.ParquetFileFormat()
+        else:
+            fileFormat = pyarrow.dataset.IpcFileFormat()
+        pyarrow.dataset.write_dataset(
+            table, columnarState['path'], format=fileFormat,
+            file_options=fileFormat.make_write_options(compression=options['compression']),
+            partitioning=['difficulty'] if options['partitionByDifficulty'] else None, partitioning_flavor='hive',
+            basename_template=f"part-{columnarState['runId']}-{columnarState['parts']}-{{i}}{COLUMNAR_EXTENSIONS[options['format']]}",
+            existing_data_behavior='overwrite_or_ignore')
+        columnarState['parts'] += 1
+        return
+
+    if columnarState['writer'] is None:
+        if options['format'] == 'parquet':
+            columnarState['writer'] = pyarrow.parquet.ParquetWriter(columnarState['path'], columnarState['schema'],
+                                                                    compression=options['compression'])
+        else:
+            columnarState['writer'] = pyarrow.ipc.new_file(columnarState['path'], columnarState['schema'],
+                                                           options=pyarrow.ipc.IpcWriteOptions(compression=options['compression']))
+    columnarState['writer'].write_table(table)
+
+# Function to finish a columnar output
+"""
+    :param columnarState: state from new_columnar_state
+"""
+def close_columnar_writer(columnarState):
+    if columnarState['writer'] is not None:
+        columnarState['writer'].close()
+        columnarState['writer'] = None
+
+# Function to write a whole dataframe of classified recipes to a columnar output
+"""
+    :param recipesDF: classified dataframe, helper columns included
+    :param columnarPath
+    :param columnarOptions: options from get_columnar_options
+"""
+def write_columnar_output(recipesDF, columnarPath, columnarOptions):
+    columnarState = new_columnar_state(columnarPath, columnarOptions)
+    write_columnar_chunk(recipesDF, columnarState)
+    close_columnar_writer(columnarState)
+
+# Function to write the results rows to a columnar file next to the results csv
+"""
+    :param results_DF: results dataframe written by write_results_file
+    :param resultOutputFilePath
+    :param columnarOptions: options from get_columnar_options
+"""
+def write_results_columnar(results_DF, resultOutputFilePath, columnarOptions):
+    import_pyarrow()
+    results_DF = results_DF.copy()
+    results_DF['difficulty'] = pd.Categorical(results_DF['difficulty'], categories=DIFFICULTY_LEVELS, ordered=True)
+    results_DF['total_time'] = results_DF['total_time'].astype(np.float64)
+    columnarPath = get_columnar_path(resultOutputFilePath, columnarOptions)
+    remove_columnar_output(columnarPath)
+    if columnarOptions['format'] == 'parquet':
+        results_DF.to_parquet(columnarPath, index=False, compression=columnarOptions['compression'])
+    else:
+        results_DF.to_feather(columnarPath, compression=columnarOptions['compression'])
+
+# Function to group an iterable into lists of at most chunkSize items
+"""
+    :param iterable
+    :param chunkSize
+    :return: generator of lists
+"""
+def iter_chunks(iterable, chunkSize):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= chunkSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Function to run the ETL in memory, the whole file is loaded before filtering
+"""
+    :param saveFilePath
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :return: difficulty stats
+"""
+def run_batch_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, thresholds=None, columnarOptions=None, dedupeKey=None, decodeOptions=None):
+    # Read file in dataframe and perform ETL, the lines are decoded in batches like in the other modes (parse stage)
+    # New lines in text values are cleaned when the csv is written
+    with open(saveFilePath, 'rb') as file:
+        jsonData = list(iter_decoded_records(file, **(decodeOptions or {}))) # This is returned as an array of objects
+
+    # Extract recipes with "Chilies" or its variants
+    with track_stage('filter', len(jsonData)) as counts:
+        recipes_with_chilies = list(iter_unique_recipes(iter_chilies_recipes(jsonData), dedupeKey))
+        counts['rowsOut'] = len(recipes_with_chilies)
+
+    # Convert to Dataframe
+    recipes_with_chiliesDF = build_recipes_frame(recipes_with_chilies)
+
+    # Proceeding further only if there is any data with recipes that has “Chilies” as one of the ingredients.
+    stats = {}
+    if not recipes_with_chiliesDF.empty:
+        with track_stage('classify', len(recipes_with_chiliesDF)) as counts:
+            recipes_with_chiliesDF = classify_recipes(recipes_with_chiliesDF, thresholds)
+            counts['rowsOut'] = len(recipes_with_chiliesDF)
+
+        # Group by difficulty and calculate the average total_time
+        with track_stage('aggregate', len(recipes_with_chiliesDF)):
+            stats = update_difficulty_stats({}, recipes_with_chiliesDF)
+        write_results(stats, resultOutputFilePath, columnarOptions)
+
+        with track_stage('write_chilies', len(recipes_with_chiliesDF)) as counts:
+            # Save dataframe to csv, duplicates were dropped while reading
+            columns = [column for column in recipes_with_chiliesDF.columns if column not in HELPER_COLUMNS]
+            recipes_with_chiliesDF = clean_newlines(recipes_with_chiliesDF)
+            # Write Chiles data to csv
+            write_csv_file(recipes_with_chiliesDF[columns], chileOutputFilePath)
+            if columnarOptions is not None:
+                write_columnar_output(recipes_with_chiliesDF, get_columnar_path(chileOutputFilePath, columnarOptions), columnarOptions)
+            counts['rowsOut'] = len(recipes_with_chiliesDF)
+    return stats
+
+# Function to create the state of a csv written chunk by chunk, see write_csv_chunk and close_csv_writer
+"""
+    :param stats: running difficulty stats updated by every chunk, defaults to new stats
+    :param columns: header of an existing csv to append to, None to start a new file
+    :param columnarState: state from new_columnar_state to also write the chunks to, None for the csv only
+    :return: writer state dict
+"""
+def new_writer_state(stats=None, columns=None, columnarState=None):
+    return {'stats': {} if stats is None else stats, 'columns': columns, 'headerWritten': columns is not None, 'append': columns is not None,
+            'columnar': columnarState, 'file': None, 'outputFilePath': None, 'appendSize': None}
+
+# Function to classify one chunk of recipes, add it to the running stats and write it to a csv
+"""
+    :param chunk: list of recipes
+    :param outputFilePath
+    :param writerState: state from new_writer_state, updated in place
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+"""
+def write_recipes_chunk(chunk, outputFilePath, writerState, thresholds=None):
+    with track_stage('classify', len(chunk)) as counts:
+        chunkDF = classify_recipes(build_recipes_frame(chunk), thresholds)
+        counts['rowsOut'] = len(chunkDF)
+    with track_stage('aggregate', len(chunkDF)):
+        update_difficulty_stats(writerState['stats'], chunkDF)
+
+    with track_stage('write_chilies', len(chunkDF)) as counts:
+        write_classified_chunk(chunkDF, outputFilePath, writerState)
+        counts['rowsOut'] = counts['rowsIn']
+
+# Function to clean and append one classified chunk to a csv, duplicates are dropped while reading, see iter_unique_recipes
+"""
+    :param chunkDF: classified dataframe
+    :param outputFilePath
+    :param writerState: state from new_writer_state, updated in place
+"""
+def write_classified_chunk(chunkDF, outputFilePath, writerState):
+    chunkDF = clean_newlines(chunkDF)
+    # The header is taken from the first chunk, later chunks are aligned to it
+    if writerState['columns'] is None:
+        writerState['columns'] = [column for column in chunkDF.columns if column not in HELPER_COLUMNS]
+    # A field missing from the header would be dropped from the csv, so the run fails instead
+    newColumns = [column for column in chunkDF.columns if column not in writerState['columns'] and column not in HELPER_COLUMNS]
+    if newColumns:
+        raise ValueError('Recipes have fields ' + ', '.join(map(str, newColumns)) + ' that are not in the header of ' + str(outputFilePath)
+                         + ', set recordFields to the fields to keep or run without streaming (a full rebuild for an incremental run)')
+    chunkDF = chunkDF.reindex(columns=writerState['columns'] + HELPER_COLUMNS)
+
+    # Write data to csv, the header is written with the first chunk only
+    if not chunkDF.empty:
+        write_csv_chunk(chunkDF[writerState['columns']], outputFilePath, writerState)
+        # The columnar output keeps the durations in minutes and the total time
+        if writerState['columnar'] is not None:
+            write_columnar_chunk(chunkDF, writerState['columnar'])
+
+# Function to classify recipes chunk by chunk, add them to running stats and write them to the Chilies csv
+# Memory is bounded by the chunk size, plus one hash per recipe in iter_unique_recipes.
+"""
+    :param recipes: iterable of recipes with chilies
+    :param chileOutputFilePath
+    :param stats: running difficulty stats, updated in place
+    :param chunkSize: number of matched recipes classified and written at once
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param columns: header of an existing csv to append to, None to start a new file
+    :param columnarOptions: options from get_columnar_options, None to write the csv only
+    :param columnarDataset: write the columnar output as a dataset that later runs can append to, see new_columnar_state
+    :return: header of the csv, None if nothing was written
+"""
+def write_chilies_chunks(recipes, chileOutputFilePath, stats, chunkSize=10000, thresholds=None, columns=None,
+                         columnarOptions=None, columnarDataset=False):
+    columnarState = None
+    if columnarOptions is not None:
+        # An existing csv is appended to, so is the columnar dataset next to it
+        columnarState = new_columnar_state(get_columnar_path(chileOutputFilePath, columnarOptions), columnarOptions,
+                                           append=columns is not None, dataset=columnarDataset)
+    writerState = new_writer_state(stats, columns, columnarState)
+    try:
+        for chunk in iter_tracked(iter_chunks(recipes, chunkSize), 'filter'):
+            write_recipes_chunk(chunk, chileOutputFilePath, writerState, thresholds)
+    except BaseException:
+        close_csv_writer(writerState, commit=False)
+        raise
+    finally:
+        if columnarState is not None:
+            close_columnar_writer(columnarState)
+    close_csv_writer(writerState)
+    return writerState['columns'] if writerState['headerWritten'] else None
+
+# Function to run the ETL in a single streaming pass
+# Lines are parsed, filtered and classified lazily and written out chunk by chunk.
+"""
+    :param saveFilePath
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param chunkSize: number of matched recipes classified and written at once
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: difficulty stats
+"""
+def run_streaming_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, chunkSize=10000, thresholds=None, decodeOptions=None,
+                      columnarOptions=None, dedupeKey=None):
+    stats = {}
+    with open(saveFilePath, 'rb') as file:
+        recipes_with_chilies = iter_unique_recipes(iter_chilies_recipes(iter_decoded_records(file, **(decodeOptions or {}))), dedupeKey)
+        write_chilies_chunks(recipes_with_chilies, chileOutputFilePath, stats, chunkSize, thresholds, columnarOptions=columnarOptions)
+
+    if stats:
+        write_results(stats, resultOutputFilePath, columnarOptions)
+    return stats
+
+# Function to run the streaming ETL directly on the HTTP response body while it downloads
+# Wall clock time becomes roughly max(download, compute) instead of their sum.
+"""
+    :param sourceFileUrl
+    :param saveFilePath: local copy of the file, refreshed from the stream when cacheDownload is set
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param session: requests.Session, defaults to plain requests calls
+    :param chunkSize: number of matched recipes classified and written at once
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param downloadChunkSize: size of the chunks read from the response
+    :param cacheDownload: tee the body to saveFilePath while processing it
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: False if the file did not change upstream and nothing was streamed, True otherwise
+"""
+def run_download_streaming_etl(sourceFileUrl, saveFilePath, chileOutputFilePath, resultOutputFilePath, session=None,
+                               chunkSize=10000, thresholds=None, downloadChunkSize=8192, cacheDownload=True, decodeOptions=None,
+                               columnarOptions=None, dedupeKey=None):
+    http = session or requests
+    headers = get_conditional_headers(saveFilePath, load_download_meta(saveFilePath)) if cacheDownload else {}
+    response = http.get(sourceFileUrl, stream=True, headers=headers)
+    if response.status_code == 304:
+        return False
+    response.raise_for_status()
+
+    stats = {}
+    lines = iter_response_lines(response, downloadChunkSize, saveFilePath if cacheDownload else None)
+    recipes_with_chilies = iter_unique_recipes(iter_chilies_recipes(iter_decoded_records(lines, **(decodeOptions or {}))), dedupeKey)
+    write_chilies_chunks(recipes_with_chilies, chileOutputFilePath, stats, chunkSize, thresholds, columnarOptions=columnarOptions)
+    if stats:
+        write_results(stats, resultOutputFilePath, columnarOptions)
+
+    validators = get_validators(response)
+    if cacheDownload and (validators['etag'] or validators['lastModified']):
+        save_download_meta(saveFilePath, dict(validators, url=sourceFileUrl, complete=True))
+    return True
+
+# Function to run the ETL for several ingredients in a single read of the file
+# Every recipe is scanned once by the matcher and routed to the csv of each of its tags.
+"""
+    :param saveFilePath
+    :param ingredientPatterns: dict of tag -> {'pattern', 'prefilter', 'outputFilePath', 'resultOutputFilePath' (optional)}
+    :param chunkSize: number of recipes per tag classified and written at once
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: dict of tag -> difficulty stats
+"""
+def run_multi_ingredient_etl(saveFilePath, ingredientPatterns, chunkSize=10000, thresholds=None, decodeOptions=None, columnarOptions=None,
+                             dedupeKey=None):
+    matcher = build_ingredient_matcher(ingredientPatterns)
+    writerStates = {}
+    for tag, options in ingredientPatterns.items():
+        columnarState = None
+        if columnarOptions is not None:
+            columnarState = new_columnar_state(get_columnar_path(options['outputFilePath'], columnarOptions), columnarOptions)
+        writerStates[tag] = new_writer_state(columnarState=columnarState)
+    buffers = {tag: [] for tag in ingredientPatterns}
+
+    try:
+        with open(saveFilePath, 'rb') as file:
+            tagged_recipes = iter_tagged_recipes(iter_decoded_records(file, **(decodeOptions or {})), matcher)
+            # A duplicate has the tags of its first occurrence, so duplicates are dropped once for all the tags
+            seen = set()
+            for tagged_chunk in iter_tracked(iter_chunks(tagged_recipes, chunkSize), 'filter'):
+                for recipe, tags in tagged_chunk:
+                    recipe_hash = get_recipe_hash(recipe, dedupeKey)
+                    if recipe_hash is not None:
+                        if recipe_hash in seen:
+                            continue
+                        seen.add(recipe_hash)
+                    for tag in tags:
+                        buffers[tag].append(recipe)
+                        if len(buffers[tag]) >= chunkSize:
+                            write_recipes_chunk(buffers[tag], ingredientPatterns[tag]['outputFilePath'], writerStates[tag], thresholds)
+                            buffers[tag] = []
+
+        for tag, buffer in buffers.items():
+            if buffer:
+                write_recipes_chunk(buffer, ingredientPatterns[tag]['outputFilePath'], writerStates[tag], thresholds)
+    except BaseException:
+        for writerState in writerStates.values():
+            close_csv_writer(writerState, commit=False)
+        raise
+
+    for tag in ingredientPatterns:
+        close_csv_writer(writerStates[tag])
+        if writerStates[tag]['columnar'] is not None:
+            close_columnar_writer(writerStates[tag]['columnar'])
+        if writerStates[tag]['stats'] and ingredientPatterns[tag].get('resultOutputFilePath'):
+            write_results(writerStates[tag]['stats'], ingredientPatterns[tag]['resultOutputFilePath'], columnarOptions)
+
+    return {tag: writerState['stats'] for tag, writerState in writerStates.items()}
+
+# Bytes before the watermark that are hashed to detect a rewritten (not appended) source file
+WATERMARK_HASH_BYTES = 65536
+
+# Function to hash a byte range of a file
+"""
+    :param filePath
+    :param start
+    :param end
+    :return: sha256 hex digest
+"""
+def hash_file_range(filePath, start, end):
+    digest = hashlib.sha256()
+    with open(filePath, 'rb') as file:
+        file.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = file.read(min(remaining, 1024 * 1024))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+# Function to read the persisted state of the incremental ETL
+"""
+    :param stateFilePath
+    :return: state dict, or None if there is no state yet
+"""
+def load_etl_state(stateFilePath):
+    if not os.path.isfile(stateFilePath):
+        return None
+    with open(stateFilePath, 'r') as file:
+        return json.load(file)
+
+# Function to persist the state of the incremental ETL, the file is replaced atomically
+"""
+    :param stateFilePath
+    :param state
+"""
+def save_etl_state(stateFilePath, state):
+    tmpFilePath = stateFilePath + '.tmp'
+    with open(tmpFilePath, 'w') as file:
+        json.dump(state, file)
+    os.replace(tmpFilePath, stateFilePath)
+
+# Function to get the path of the file holding the recipe hashes of the incremental ETL, one hex hash per line
+# The file is only appended to, the state keeps its size so that lines written by a failed run are ignored
+"""
+    :param stateFilePath
+    :return: path of the hashes file
+"""
+def get_recipe_hashes_path(stateFilePath):
+    return stateFilePath + '.hashes'
+
+# Function to read the recipe hashes saved by the previous runs of the incremental ETL
+"""
+    :param hashesFilePath
+    :param size: number of bytes written by the successful runs, see get_recipe_hashes_path
+    :return: set of hex hashes
+"""
+def load_recipe_hashes(hashesFilePath, size):
+    if size == 0:
+        return set()
+    with open(hashesFilePath, 'rb') as file:
+        return set(file.read(size).decode('ascii').split())
+
+# Function to append the hashes of newly kept recipes to the hashes file
+"""
+    :param hashesFilePath
+    :param hashes: list of hex hashes
+    :return: size of the hashes file
+"""
+def append_recipe_hashes(hashesFilePath, hashes):
+    with open(hashesFilePath, 'a', encoding='ascii') as file:
+        file.write(''.join(recipe_hash + '\n' for recipe_hash in hashes))
+    return os.path.getsize(hashesFilePath)
+
+# Function to cut a file back to the size saved by the last successful run, the bytes after it were written by a failed run
+"""
+    :param filePath
+    :param size
+"""
+def truncate_file(filePath, size):
+    if os.path.isfile(filePath) and os.path.getsize(filePath) > size:
+        os.truncate(filePath, size)
+
+# Function to check that the source file still starts with the bytes processed by the previous run
+"""
+    :param filePath
+    :param state
+    :return: True if only lines after the watermark are new
+"""
+def is_watermark_valid(filePath, state):
+    offset = state['offset']
+    if os.path.getsize(filePath) < offset:
+        return False
+    return hash_file_range(filePath, max(offset - WATERMARK_HASH_BYTES, 0), offset) == state['tailHash']
+
+# Function to lazily read the complete jsonl lines after an offset
+# A trailing line without a newline may still be written by the feed, it is left for the next run
+"""
+    :param filePath
+    :param progress: dict with the 'offset' to start from, updated with the end of every consumed line
+    :return: generator of lines as bytes
+"""
+def iter_new_lines(filePath, progress):
+    with open(filePath, 'rb') as file:
+        file.seek(progress['offset'])
+        for line in file:
+            if not line.endswith(b'\n'):
+                break
+            progress['offset'] += len(line)
+            yield line
+
+# Function to lazily decode the complete jsonl lines after an offset
+"""
+    :param filePath
+    :param progress: dict with the 'offset' to start from, updated with the end of every consumed line
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :return: generator of json objects
+"""
+def iter_new_json_lines(filePath, progress, decodeOptions=None):
+    yield from iter_decoded_records(iter_new_lines(filePath, progress), **(decodeOptions or {}))
+
+# Function to run the ETL only over the lines appended since the previous run
+# The per-difficulty sums and counts, a watermark (byte offset plus a hash of the bytes before it) and the
+# sizes of the csv and of the hashes file are persisted, so a rerun costs time proportional to the new lines and
+# drops recipes that an earlier run already wrote. The new rows and hashes are appended in place, whatever a failed
+# run appended after the saved sizes is cut off. A rewritten source or fullRebuild starts again from the
+# beginning of the file.
+"""
+    :param saveFilePath
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param stateFilePath
+    :param chunkSize: number of matched recipes classified and written at once
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param fullRebuild: ignore the persisted state and reprocess the whole file
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: difficulty stats of the whole file
+"""
+def run_incremental_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, stateFilePath, chunkSize=10000, thresholds=None, fullRebuild=False, decodeOptions=None,
+                        columnarOptions=None, dedupeKey=None):
+    state = None if fullRebuild else load_etl_state(stateFilePath)
+    if state is not None and (state.get('thresholds') != thresholds or not is_watermark_valid(saveFilePath, state)):
+        print("Source file changed before the watermark or thresholds changed, rebuilding from scratch.")
+        state = None
+    if state is not None and ('hashesSize' not in state or state.get('dedupeKey') != dedupeKey):
+        print("The state has no recipe hashes for this dedupeKey, rebuilding from scratch.")
+        state = None
+    hashesFilePath = get_recipe_hashes_path(stateFilePath)
+    if state is not None and (not os.path.isfile(chileOutputFilePath) or os.path.getsize(chileOutputFilePath) < state['csvSize']
+                              or (os.path.getsize(hashesFilePath) if os.path.isfile(hashesFilePath) else 0) < state['hashesSize']):
+        print(f"'{chileOutputFilePath}' or the recipe hashes are shorter than saved in the state, rebuilding from scratch.")
+        state = None
+    if state is not None and RESULT_PERCENTILES['percentiles'] and any('sketch' not in bucket for bucket in state['stats'].values()):
+        print("Percentiles are set but the state has no sketches of the processed recipes, rebuilding from scratch.")
+        state = None
+    if state is None:
+        state = {'offset': 0, 'stats': {}, 'columns': None, 'thresholds': thresholds, 'dedupeKey': dedupeKey, 'csvSize': 0, 'hashesSize': 0}
+    else:
+        # Rows and hashes appended by a run that failed before saving the state
+        truncate_file(chileOutputFilePath, state['csvSize'])
+    truncate_file(hashesFilePath, state['hashesSize'])
+
+    progress = {'offset': state['offset']}
+    # Duplicates of recipes written by earlier increments are dropped too
+    seen = load_recipe_hashes(hashesFilePath, state['hashesSize'])
+    added = []
+    recipes_with_chilies = iter_unique_recipes(iter_chilies_recipes(iter_new_json_lines(saveFilePath, progress, decodeOptions)), dedupeKey, seen,
+                                               added)
+    # The columnar output is a dataset, every increment adds its own files to it
+    columns = write_chilies_chunks(recipes_with_chilies, chileOutputFilePath, state['stats'], chunkSize, thresholds, state['columns'],
+                                   columnarOptions, columnarDataset=True)
+
+    if progress['offset'] == state['offset']:
+        print(f"No new recipes since byte offset {state['offset']}.")
+        return state['stats']
+
+    if state['stats']:
+        write_results(state['stats'], resultOutputFilePath, columnarOptions)
+
+    state['columns'] = columns
+    state['csvSize'] = os.path.getsize(chileOutputFilePath) if os.path.isfile(chileOutputFilePath) else 0
+    state['hashesSize'] = append_recipe_hashes(hashesFilePath, added)
+    state['offset'] = progress['offset']
+    state['tailHash'] = hash_file_range(saveFilePath, max(progress['offset'] - WATERMARK_HASH_BYTES, 0), progress['offset'])
+    save_etl_state(stateFilePath, state)
+    return state['stats']
+
+# Version of the parse cache, bump it when the filtering or the cached columns change
+PARSE_CACHE_VERSION = 1
+
+# Function to get the key of the options that change what is cached for a source file
+"""
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: short hex key
+"""
+def get_parse_cache_params(decodeOptions=None, dedupeKey=None):
+    fields = (decodeOptions or {}).get('fields')
+    params = {'version': PARSE_CACHE_VERSION, 'fields': sorted(fields) if fields else None, 'dedupeKey': dedupeKey}
+    return hashlib.sha256(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+# Function to find the parse cache key of a source file
+# A file with the path, size and mtime of a cached entry is not hashed again, other files are looked up by the hash of their content
+"""
+    :param index: parse cache index, dict of key -> entry
+    :param saveFilePath
+    :param paramsKey: key from get_parse_cache_params
+    :return: cache key, it is not in the index yet when the content was never cached
+"""
+def find_parse_cache_key(index, saveFilePath, paramsKey):
+    stat = os.stat(saveFilePath)
+    sourcePath = os.path.abspath(saveFilePath)
+    for key, entry in index['entries'].items():
+        if (entry['params'] == paramsKey and entry['sourcePath'] == sourcePath
+                and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns):
+            return key
+    return f"{hash_file_range(saveFilePath, 0, stat.st_size)}-{paramsKey}"
+
+# Function to read cached recipes, the Arrow file is memory-mapped instead of read
+"""
+    :param cacheFilePath
+    :return: dataframe of recipes
+"""
+def load_parse_cache(cacheFilePath):
+    pyarrow = import_pyarrow('parseCacheDir')
+    return pyarrow.ipc.open_file(pyarrow.memory_map(cacheFilePath, 'r')).read_all().to_pandas()
+
+# Function to write recipes to the parse cache as an uncompressed Arrow file, so that it can be memory-mapped
+"""
+    :param recipesDF: dataframe of recipes
+    :param cacheFilePath
+"""
+def store_parse_cache(recipesDF, cacheFilePath):
+    pyarrow = import_pyarrow('parseCacheDir')
+    table = pyarrow.Table.from_pandas(recipesDF, preserve_index=False)
+    tmpFilePath = cacheFilePath + '.tmp'
+    with pyarrow.ipc.new_file(tmpFilePath, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmpFilePath, cacheFilePath)
+
+# Function to remove the least recently used parse cache entries until the cache fits its size
+"""
+    :param cacheDir
+    :param index: parse cache index, updated in place
+    :param maxBytes: maximum size of the cached files
+"""
+def evict_parse_cache(cacheDir, index, maxBytes):
+    totalBytes = sum(entry['bytes'] for entry in index['entries'].values())
+    for key, entry in sorted(index['entries'].items(), key=lambda item: item[1]['lastUsed']):
+        if totalBytes <= maxBytes:
+            break
+        cacheFilePath = os.path.join(cacheDir, key + '.arrow')
+        if os.path.isfile(cacheFilePath):
+            os.remove(cacheFilePath)
+        del index['entries'][key]
+        totalBytes -= entry['bytes']
+        print(f"Evicted parse cache of '{entry['sourcePath']}' ({entry['bytes']} bytes).")
+
+# Function to get the recipes with chilies and their durations in minutes, from the parse cache when the file was parsed before
+# The cache holds the filtered and cleaned recipes before classification, so difficulty thresholds can change without invalidating it.
+"""
+    :param saveFilePath
+    :param cacheDir: directory of the cached files and of index.json
+    :param cacheMaxBytes: maximum size of the cached files, least recently used ones are evicted first
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: dataframe of unique recipes with cookTime_minutes and prepTime_minutes
+"""
+def read_parsed_recipes(saveFilePath, cacheDir, cacheMaxBytes=1024 * 1024 * 1024, decodeOptions=None, dedupeKey=None):
+    pyarrow = import_pyarrow('parseCacheDir')
+    os.makedirs(cacheDir, exist_ok=True)
+    indexFilePath = os.path.join(cacheDir, 'index.json')
+    index = load_etl_state(indexFilePath) or {'entries': {}}
+
+    with track_stage('parse_cache') as counts:
+        paramsKey = get_parse_cache_params(decodeOptions, dedupeKey)
+        key = find_parse_cache_key(index, saveFilePath, paramsKey)
+        cacheFilePath = os.path.join(cacheDir, key + '.arrow')
+        recipesDF = None
+        if key in index['entries'] and os.path.isfile(cacheFilePath):
+            recipesDF = load_parse_cache(cacheFilePath)
+            counts['rowsOut'] = len(recipesDF)
+
+    if recipesDF is not None:
+        print(f"Parse cache hit for '{saveFilePath}', {len(recipesDF)} recipes read from {cacheFilePath}.")
+    else:
+        with open(saveFilePath, 'rb') as file:
+            with track_stage('filter') as counts:
+                recipesDF = build_recipes_frame(list(iter_unique_recipes(iter_chilies_recipes(iter_decoded_records(file, **(decodeOptions or {}))), dedupeKey)))
+                counts['rowsOut'] = len(recipesDF)
+        if not recipesDF.empty:
+            with track_stage('classify', len(recipesDF)):
+                recipesDF = clean_newlines(add_duration_minutes(recipesDF))
+
+        with track_stage('parse_cache', len(recipesDF)):
+            try:
+                store_parse_cache(recipesDF, cacheFilePath)
+            except pyarrow.ArrowException as error:
+                # Values that Arrow cannot type, e.g. a field mixing numbers and strings, are not cached
+                print(f"Recipes of '{saveFilePath}' could not be cached: {error}")
+                return recipesDF
+
+    stat = os.stat(saveFilePath)
+    index['entries'][key] = {'sourcePath': os.path.abspath(saveFilePath), 'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                             'params': paramsKey, 'bytes': os.path.getsize(cacheFilePath), 'lastUsed': time.time()}
+    evict_parse_cache(cacheDir, index, cacheMaxBytes)
+    save_etl_state(indexFilePath, index)
+    return recipesDF
+
+# Function to run the ETL on the recipes of the parse cache, the source file is only parsed when it is not cached yet
+"""
+    :param saveFilePath
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param cacheDir: directory of the parse cache
+    :param cacheMaxBytes: maximum size of the parse cache
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+    :return: difficulty stats
+"""
+def run_cached_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, cacheDir, cacheMaxBytes=1024 * 1024 * 1024, thresholds=None,
+                   decodeOptions=None, columnarOptions=None, dedupeKey=None):
+    recipes_with_chiliesDF = read_parsed_recipes(saveFilePath, cacheDir, cacheMaxBytes, decodeOptions, dedupeKey)
+    if recipes_with_chiliesDF.empty:
+        return {}
+
+    with track_stage('classify', len(recipes_with_chiliesDF)) as counts:
+        recipes_with_chiliesDF = add_difficulty(recipes_with_chiliesDF, thresholds)
+        counts['rowsOut'] = len(recipes_with_chiliesDF)
+    with track_stage('aggregate', len(recipes_with_chiliesDF)):
+        stats = update_difficulty_stats({}, recipes_with_chiliesDF)
+    write_results(stats, resultOutputFilePath, columnarOptions)
+
+    columnarState = None
+    if columnarOptions is not None:
+        columnarState = new_columnar_state(get_columnar_path(chileOutputFilePath, columnarOptions), columnarOptions)
+    with track_stage('write_chilies', len(recipes_with_chiliesDF)) as counts:
+        writerState = new_writer_state(columnarState=columnarState)
+        try:
+            write_classified_chunk(recipes_with_chiliesDF, chileOutputFilePath, writerState)
+        except BaseException:
+            close_csv_writer(writerState, commit=False)
+            raise
+        close_csv_writer(writerState)
+        if columnarState is not None:
+            close_columnar_writer(columnarState)
+        counts['rowsOut'] = counts['rowsIn']
+    return stats
+
+# Function to get the path of the line index stored next to a jsonl file
+"""
+    :param filePath
+    :return: path of the numpy file of line offsets
+"""
+def get_line_index_path(filePath):
+    return filePath + '.lines.npy'
+
+# Function to find the offset of every line of a jsonl file
+"""
+    :param filePath
+    :param blockSize: number of bytes scanned for new lines at once
+    :return: int64 numpy array of the start offset of every line followed by the file size, one more entry than lines
+"""
+def build_line_index(filePath, blockSize=16 * 1024 * 1024):
+    parts = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with open(filePath, 'rb') as file:
+        while True:
+            block = file.read(blockSize)
+            if not block:
+                break
+            parts.append(np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n')).astype(np.int64) + position + 1)
+            position += len(block)
+    offsets = np.concatenate(parts)
+    # A last line without a new line ends at the end of the file
+    if offsets[-1] != position:
+        offsets = np.append(offsets, position)
+    return offsets
+
+# Function to load the line index of a jsonl file, it is built and saved next to the file when it is missing or stale
+# The saved index is memory-mapped, so only the offsets that are used are read from disk
+"""
+    :param filePath
+    :return: int64 numpy array from build_line_index
+"""
+def load_line_index(filePath):
+    indexFilePath = get_line_index_path(filePath)
+    if os.path.isfile(indexFilePath) and os.stat(indexFilePath).st_mtime_ns >= os.stat(filePath).st_mtime_ns:
+        offsets = np.load(indexFilePath, mmap_mode='r')
+        if len(offsets) > 0 and offsets[-1] == os.path.getsize(filePath):
+            return offsets
+
+    offsets = build_line_index(filePath)
+    tmpFilePath = indexFilePath + '.tmp'
+    with open(tmpFilePath, 'wb') as file:
+        np.save(file, offsets)
+    os.replace(tmpFilePath, indexFilePath)
+    return offsets
+
+# Function to memory map a whole file for reading
+# Every map holds a file descriptor until it is garbage collected, so a caller maps the file once and slices it
+"""
+    :param filePath: file that is not empty
+    :return: memoryview of the map, the map is closed when the view and its last slice are released
+"""
+def map_file(filePath):
+    with open(filePath, 'rb') as file:
+        return memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+
+# Function to lazily read lines of a jsonl file as slices of a memory map
+# The slices are zero-copy memoryviews, they are handed to the JSON decoders as they are
+"""
+    :param filePath
+    :param lineIndex: offsets from load_line_index
+    :param firstLine: number of the first line, 0 based
+    :param lastLine: number after the last line, None for the end of the file
+    :param view: map of the file from map_file, None to map it for this call
+    :return: generator of lines as memoryview
+"""
+def iter_mmap_lines(filePath, lineIndex, firstLine=0, lastLine=None, view=None):
+    lineCount = len(lineIndex) - 1
+    lastLine = lineCount if lastLine is None else min(lastLine, lineCount)
+    if firstLine >= lastLine:
+        return
+    if view is None:
+        view = map_file(filePath)
+    # Offsets are converted to python ints a block at a time, so a large range does not become one large list
+    for blockStart in range(firstLine, lastLine, 65536):
+        offsets = lineIndex[blockStart:min(blockStart + 65536, lastLine) + 1].tolist()
+        for start, end in zip(offsets, offsets[1:]):
+            yield view[start:end]
+
+# Function to read the records of a range of lines, e.g. to run a failed range again
+"""
+    :param filePath
+    :param firstLine: number of the first line, 0 based
+    :param lastLine: number after the last line
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :return: list of json objects
+"""
+def read_line_range(filePath, firstLine, lastLine, decodeOptions=None):
+    return list(iter_decoded_records(iter_mmap_lines(filePath, load_line_index(filePath), firstLine, lastLine), **(decodeOptions or {})))
+
+# Function to read random records of a jsonl file without scanning it
+"""
+    :param filePath
+    :param count: number of records wanted
+    :param seed: random seed, the same seed gives the same sample
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :return: list of json objects in file order
+"""
+def sample_records(filePath, count, seed=None, decodeOptions=None):
+    lineIndex = load_line_index(filePath)
+    lineCount = len(lineIndex) - 1
+    if lineCount == 0:
+        return []
+    lines = np.sort(np.random.default_rng(seed).choice(lineCount, size=min(count, lineCount), replace=False))
+    # All the sampled lines are sliced from one map of the file
+    view = map_file(filePath)
+    sampled = (line for number in lines.tolist() for line in iter_mmap_lines(filePath, lineIndex, number, number + 1, view))
+    return list(iter_decoded_records(sampled, **(decodeOptions or {})))
+
+# Function to split a jsonl file into byte ranges that start and end on line boundaries
+"""
+    :param filePath
+    :param shardCount: number of shards wanted, fewer are returned for small files
+    :return: list of (start, end) byte offsets
+"""
+def compute_shard_offsets(filePath, shardCount):
+    lineIndex = load_line_index(filePath)
+    size = int(lineIndex[-1])
+    # Every boundary is the first line that starts at or after an even split of the bytes
+    targets = [size * shard // shardCount for shard in range(1, shardCount)]
+    boundaries = [0] + lineIndex[np.searchsorted(lineIndex, targets)].tolist() + [size]
+    return [(start, end) for start, end in zip(boundaries, boundaries[1:]) if end > start]
+
+# Function to lazily read the lines of a byte range
+"""
+    :param filePath
+    :param start: offset of the first line of the range
+    :param end: offset just after the last line of the range
+    :return: generator of lines as memoryview
+"""
+def iter_byte_range_lines(filePath, start, end):
+    lineIndex = load_line_index(filePath)
+    yield from iter_mmap_lines(filePath, lineIndex, int(np.searchsorted(lineIndex, start)), int(np.searchsorted(lineIndex, end)))
+
+# Function to lazily decode the jsonl lines of a byte range
+"""
+    :param filePath
+    :param start: offset of the first line of the range
+    :param end: offset just after the last line of the range
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :return: generator of json objects
+"""
+def iter_json_byte_range(filePath, start, end, decodeOptions=None):
+    yield from iter_decoded_records(iter_byte_range_lines(filePath, start, end), **(decodeOptions or {}))
+
+# Function to get the module settings a worker process needs, a worker started with spawn or forkserver does not inherit them
+"""
+    :return: dict of the settings, see configure_worker
+"""
+def get_worker_settings():
+    return {'durationMemoSize': DURATION_MEMO['maxSize'], 'resultPercentiles': RESULT_PERCENTILES['percentiles'],
+            'percentileExactLimit': RESULT_PERCENTILES['exactLimit'], 'percentileBinMinutes': RESULT_PERCENTILES['binMinutes']}
+
+# Function to apply the module settings in a worker process
+"""
+    :param settings: dict from get_worker_settings, or a config object with the same keys
+"""
+def configure_worker(settings):
+    configure_duration_memo(settings.get('durationMemoSize', 10000))
+    configure_result_percentiles(settings.get('resultPercentiles'), settings.get('percentileExactLimit', 1000), settings.get('percentileBinMinutes', 1))
+
+# Function run by every worker process of the sharded ETL: parse, filter and classify one shard
+"""
+    :param task: (filePath, start, end, thresholds, decodeOptions, dedupeKey, settings from get_worker_settings)
+    :return: (classified chilies dataframe or None, difficulty stats)
+"""
+def process_shard(task):
+    filePath, start, end, thresholds, decodeOptions, dedupeKey, settings = task
+    # Without the percentile settings the buckets of the shard would have no sketch, and the merged results no percentiles
+    configure_worker(settings)
+    recipes_with_chiliesDF = build_recipes_frame(list(iter_unique_recipes(iter_chilies_recipes(iter_json_byte_range(filePath, start, end, decodeOptions)), dedupeKey)))
+    if recipes_with_chiliesDF.empty:
+        return None, {}
+    recipes_with_chiliesDF = classify_recipes(recipes_with_chiliesDF, thresholds)
+    stats = update_difficulty_stats({}, recipes_with_chiliesDF)
+    return clean_newlines(recipes_with_chiliesDF), stats
+
+# Function to run the ETL over newline aligned shards of the file in a process pool
+# Partial results are merged in shard order, stats are merged as sums and counts so the averages stay exact
+"""
+    :param saveFilePath
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param workers: number of worker processes
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param decodeOptions: keyword arguments of iter_decoded_records
+    :param columnarOptions: options from get_columnar_options, None to write csv files only
+    :param dedupeKey: field identifying a recipe, see iter_unique_recipes
+"""
+def run_sharded_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, workers, thresholds=None, decodeOptions=None, columnarOptions=None,
+                    dedupeKey=None):
+    # A few shards per worker keeps every core busy when shards take uneven time
+    shards = compute_shard_offsets(saveFilePath, workers * 4)
+    settings = get_worker_settings()
+    tasks = [(saveFilePath, start, end, thresholds, decodeOptions, dedupeKey, settings) for start, end in shards]
+
+    stats = {}
+    frames = []
+    # Parsing, filtering and classifying happen in the workers and are measured as one stage
+    with track_stage('shards', len(tasks)) as counts:
+        results = [None] * len(tasks)
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(process_shard, task): shard for shard, task in enumerate(tasks)}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception as error:
+                    print(f"Shard of bytes {tasks[futures[future]][1]}-{tasks[futures[future]][2]} failed: {error!r}")
+
+        # Only the failed ranges are run again, in this process so that a broken pool does not fail them twice
+        for shard, task in enumerate(tasks):
+            if results[shard] is None:
+                print(f"Running shard of bytes {task[1]}-{task[2]} again.")
+                results[shard] = process_shard(task)
+
+        # Partial results are merged in shard order
+        for shardDF, shard_stats in results:
+            merge_difficulty_stats(stats, shard_stats)
+            if shardDF is not None:
+                frames.append(shardDF)
+        counts['rowsOut'] = sum(len(frame) for frame in frames)
+
+    if frames:
+        # Duplicates within a shard were dropped by the worker, duplicates across shards are dropped here
+        chiliesDF = pd.concat(frames, ignore_index=True)
+        columns = [column for column in chiliesDF.columns if column not in HELPER_COLUMNS]
+        if dedupeKey is None:
+            duplicated = chiliesDF.duplicated(subset=columns)
+        elif dedupeKey in columns:
+            # Recipes without the key are all kept, as in iter_unique_recipes
+            duplicated = chiliesDF.duplicated(subset=[dedupeKey]) & chiliesDF[dedupeKey].notna()
+        else:
+            # No recipe has the key, so none of them is a duplicate
+            duplicated = pd.Series(False, index=chiliesDF.index)
+        if duplicated.any():
+            # The stats of the workers counted these recipes once per shard
+            chiliesDF = chiliesDF[~duplicated]
+            with track_stage('aggregate', len(chiliesDF)):
+                stats = update_difficulty_stats({}, chiliesDF)
+        write_results(stats, resultOutputFilePath, columnarOptions)
+        with track_stage('write_chilies', len(chiliesDF)) as counts:
+            # Write Chiles data to csv
+            write_csv_file(chiliesDF[columns], chileOutputFilePath)
+            if columnarOptions is not None:
+                write_columnar_output(chiliesDF, get_columnar_path(chileOutputFilePath, columnarOptions), columnarOptions)
+            counts['rowsOut'] = len(chiliesDF)
+
+# Function to print the difficulty of a random sample of recipes
+"""
+    :param saveFilePath
+    :param count: number of recipes sampled
+    :param thresholds: difficulty thresholds, see DEFAULT_DIFFICULTY_THRESHOLDS
+    :param decodeOptions: keyword arguments of iter_decoded_records
+"""
+def print_sample_summary(saveFilePath, count, thresholds=None, decodeOptions=None):
+    records = sample_records(saveFilePath, count, decodeOptions=decodeOptions)
+    recipes_with_chiliesDF = build_recipes_frame(extract_chilies_recipes(records))
+    print(f"Sampled {len(records)} recipes of {len(load_line_index(saveFilePath)) - 1} lines, {len(recipes_with_chiliesDF)} with chilies.")
+    if not recipes_with_chiliesDF.empty:
+        recipes_with_chiliesDF = classify_recipes(recipes_with_chiliesDF, thresholds)
+        for difficulty, total_time in recipes_with_chiliesDF.groupby('difficulty', observed=True)['total_time']:
+            print(f"{difficulty}: {len(total_time)} recipes, average total time {total_time.mean():.1f} minutes")
+
+# Function to read the JSON decoding options from the config
+"""
+    :param config: config object
+    :return: keyword arguments of iter_decoded_records
+"""
+def get_decode_options(config):
+    # JSON decoding backend, record fields to keep and lines decoded at once
+    return {'backend': config.get('jsonBackend', 'auto'), 'fields': config.get('recordFields'),
+            'batchSize': config.get('decodeBatchSize', 1000)}
+
+# Function to run the ETL of a downloaded file in the mode set in the config: incremental, parse cache, streaming or batch
+"""
+    :param config: config object
+    :param saveFilePath
+    :param chileOutputFilePath
+    :param resultOutputFilePath
+    :param fullRebuild: ignore the persisted state of the incremental mode
+    :return: difficulty stats of the file
+"""
+def run_file_etl(config, saveFilePath, chileOutputFilePath, resultOutputFilePath, fullRebuild=False):
+    thresholds = get_difficulty_thresholds(config)
+    chunkSize = config.get('chunkSize', 10000)
+    decodeOptions = get_decode_options(config)
+    columnarOptions = get_columnar_options(config)
+    dedupeKey = config.get('dedupeKey')
+
+    # Incremental mode only processes the lines appended since the previous run
+    if config.get('incremental', False):
+        stateFilePath = config.get('stateFilePath', saveFilePath + '.state.json')
+        return run_incremental_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, stateFilePath, chunkSize, thresholds, fullRebuild, decodeOptions,
+                                   columnarOptions, dedupeKey)
+    # A file parsed by an earlier run is read from the parse cache instead of being decoded again
+    if config.get('parseCacheDir'):
+        return run_cached_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, config['parseCacheDir'],
+                              config.get('parseCacheMaxBytes', 1024 * 1024 * 1024), thresholds, decodeOptions, columnarOptions, dedupeKey)
+    # Streaming mode keeps memory proportional to the chunk size instead of the input file
+    if config.get('streaming', False):
+        return run_streaming_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, chunkSize, thresholds, decodeOptions, columnarOptions, dedupeKey)
+    return run_batch_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, thresholds, columnarOptions, dedupeKey, decodeOptions)
+
+# Function to build the config of every source of the "sources" list, the settings of a source override the top level ones
+"""
+    :param config: config object with a "sources" list
+    :return: list of config objects, one per source
+"""
+def get_source_configs(config):
+    sourceConfigs = []
+    shared = {key: value for key, value in config.items() if key not in ('sources', 'resultOutputFilePath')}
+    for number, source in enumerate(config['sources'], start=1):
+        for key in ('sourceFileUrl', 'saveFilePath', 'chileOutputFilePath'):
+            if key not in source:
+                raise ValueError(f"Source {number} of the config has no '{key}'")
+        sourceConfig = dict(shared, **source)
+        sourceConfig.setdefault('name', f"source{number}")
+        # Every source gets its own results file, the top level resultOutputFilePath holds the combined results
+        sourceConfig.setdefault('resultOutputFilePath', os.path.splitext(source['chileOutputFilePath'])[0] + '_Results.csv')
+        sourceConfigs.append(sourceConfig)
+    return sourceConfigs
+
+# Function run by the worker processes of the sources runner: the ETL of one downloaded source
+# The stamp of a source also holds its stats, so an unchanged source is skipped and still counts in the combined results
+"""
+    :param sourceConfig: config of one source, see get_source_configs
+    :param fullRebuild: run the ETL even if the source did not change, and ignore the incremental state
+    :return: difficulty stats of the source
+"""
+def run_source_etl(sourceConfig, fullRebuild=False):
+    saveFilePath = sourceConfig['saveFilePath']
+    stampFilePath = get_run_stamp_path(saveFilePath)
+    stamp = None if fullRebuild else get_up_to_date_stamp(sourceConfig, saveFilePath)
+    if stamp is not None and 'stats' in stamp:
+        print(f"[{sourceConfig['name']}] The file '{saveFilePath}' and the config did not change since the last run, the outputs are up to date.")
+        return stamp['stats']
+    if os.path.isfile(stampFilePath):
+        os.remove(stampFilePath)
+
+    configure_worker(sourceConfig)
+    stats = run_file_etl(sourceConfig, saveFilePath, sourceConfig['chileOutputFilePath'], sourceConfig['resultOutputFilePath'], fullRebuild)
+    save_etl_state(stampFilePath, dict(get_run_stamp(sourceConfig, saveFilePath), stats=stats))
+    return stats
+
+# Coroutine to download every source concurrently and hand each downloaded file to a process pool for its ETL
+# A source is processed as soon as its own download is done, so the run takes about as long as the slowest source
+"""
+    :param sourceConfigs: list from get_source_configs
+    :param session: requests.Session shared by the downloads
+    :param downloadConcurrency: maximum number of downloads at the same time
+    :param workers: number of worker processes, None for one per core
+    :param download: False to process the local copies without downloading them
+    :param fullRebuild: see run_source_etl
+    :return: list of difficulty stats per source, the exception for a source that failed
+"""
+async def run_sources_async(sourceConfigs, session, downloadConcurrency=4, workers=None, download=True, fullRebuild=False):
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(downloadConcurrency)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Start the worker processes before the download threads, a process forked while a thread holds a lock could hang
+        await loop.run_in_executor(executor, os.getpid)
+
+        async def run_source(sourceConfig):
+            if download:
+                # A failed download fails the source, its ETL does not run
+                async with semaphore:
+                    await asyncio.to_thread(download_source_file, sourceConfig, session)
+            return await loop.run_in_executor(executor, run_source_etl, sourceConfig, fullRebuild)
+
+        return await asyncio.gather(*(run_source(sourceConfig) for sourceConfig in sourceConfigs), return_exceptions=True)
+
+# Function to run the ETL of every source of the config and write the combined results
+"""
+    :param config: config object with a "sources" list
+    :param workers: number of worker processes, None for one per core
+    :param download: False to process the local copies without downloading them
+    :param fullRebuild: see run_source_etl
+    :return: combined difficulty stats
+"""
+def run_sources_etl(config, workers=None, download=True, fullRebuild=False):
+    sourceConfigs = get_source_configs(config)
+    # The combined results are written by this process from the merged sketches
+    configure_result_percentiles(config.get('resultPercentiles'), config.get('percentileExactLimit', 1000), config.get('percentileBinMinutes', 1))
+    downloadConcurrency = config.get('downloadConcurrency', 4)
+    session = create_http_session(downloadConcurrency * max(config.get('downloadWorkers', 1), 1))
+
+    with track_stage('sources', len(sourceConfigs)) as counts:
+        results = asyncio.run(run_sources_async(sourceConfigs, session, downloadConcurrency, workers, download, fullRebuild))
+
+    stats = {}
+    failed = []
+    for sourceConfig, result in zip(sourceConfigs, results):
+        if isinstance(result, BaseException):
+            print(f"[{sourceConfig['name']}] ETL failed: {result!r}")
+            failed.append(sourceConfig['name'])
+        else:
+            merge_difficulty_stats(stats, result)
+    counts['rowsOut'] = len(sourceConfigs) - len(failed)
+
+    # Sums and counts of every source are merged, so the combined averages are exact
+    if stats and config.get('resultOutputFilePath'):
+        write_results(stats, config['resultOutputFilePath'], get_columnar_options(config))
+    if failed:
+        raise ValueError(f"The ETL failed for the sources: {', '.join(failed)}")
+    return stats
+
+# Function to get the path of the stamp of the last successful run, stored next to the source file
+"""
+    :param saveFilePath
+    :return: path of the json stamp
+"""
+def get_run_stamp_path(saveFilePath):
+    return saveFilePath + '.run.json'
+
+# Function to list the files written by a run, a run is not skipped when one of them is missing
+"""
+    :param config: config object
+    :return: list of paths
+"""
+def get_run_outputs(config):
+    if config.get('ingredientPatterns'):
+        outputs = [path for options in config['ingredientPatterns'].values()
+                   for path in (options.get('outputFilePath'), options.get('resultOutputFilePath')) if path]
+    else:
+        outputs = [path for path in (config.get('chileOutputFilePath'), config.get('resultOutputFilePath')) if path]
+    outputFormat = config.get('outputFormat', 'csv')
+    if outputFormat in COLUMNAR_EXTENSIONS:
+        outputs += [os.path.splitext(path)[0] + COLUMNAR_EXTENSIONS[outputFormat] for path in outputs]
+    return outputs
+
+# Function to describe the input of a run: the version of the source file and a hash of the config
+"""
+    :param config: config object
+    :param saveFilePath
+    :return: stamp dict
+"""
+def get_run_stamp(config, saveFilePath):
+    stat = os.stat(saveFilePath)
+    configHash = hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return {'size': stat.st_size, 'mtimeNs': stat.st_mtime_ns, 'configHash': configHash}
+
+# Function to load the stamp of the last run when the outputs were written from the same source file with the same config
+# Only os.stat calls and a small json file are involved, so the check runs before pandas is imported
+"""
+    :param config: config object
+    :param saveFilePath
+    :return: stamp dict, None when the ETL has to run
+"""
+def get_up_to_date_stamp(config, saveFilePath):
+    if not config.get('skipUnchanged', True) or not os.path.isfile(saveFilePath):
+        return None
+    if not all(os.path.exists(path) for path in get_run_outputs(config)):
+        return None
+    stamp = load_etl_state(get_run_stamp_path(saveFilePath))
+    # A stamp may hold more than the stamp keys, e.g. the stats of a source
+    if stamp is None or any(stamp.get(key) != value for key, value in get_run_stamp(config, saveFilePath).items()):
+        return None
+    return stamp
+
+# Function to check if the outputs were already written from the same source file with the same config
+"""
+    :param config: config object
+    :param saveFilePath
+    :return: True when the ETL can be skipped
+"""
+def is_run_up_to_date(config, saveFilePath):
+    return get_up_to_date_stamp(config, saveFilePath) is not None
+
+# Function to print what a run would do, nothing is downloaded or written
+"""
+    :param config: config object
+    :param args: parsed command line arguments
+"""
+def print_dry_run(config, args):
+    sources = get_source_configs(config) if config.get('sources') else [config]
+    for sourceConfig in sources:
+        saveFilePath = sourceConfig.get('saveFilePath')
+        if args.stage != 'etl':
+            print(f"Dry run: would download {sourceConfig.get('sourceFileUrl')} to {saveFilePath} if it changed upstream")
+        if args.stage == 'download':
+            continue
+        # Same choice as run_etl, the sources runner always runs run_file_etl
+        if config.get('sources'):
+            mode = None
+        elif args.stage != 'etl' and config.get('streamDownload', False):
+            mode = 'download streaming'
+        elif config.get('ingredientPatterns'):
+            mode = 'multi-ingredient'
+        elif (args.workers or config.get('workers', 1)) > 1:
+            mode = 'sharded'
+        else:
+            mode = None
+        mode = mode or next((name for name in ('incremental', 'parseCacheDir', 'streaming') if sourceConfig.get(name)), 'batch')
+        if not args.full_rebuild and saveFilePath and is_run_up_to_date(sourceConfig, saveFilePath):
+            print(f"Dry run: {saveFilePath} and the config did not change since the last run, the ETL would be skipped")
+        else:
+            print(f"Dry run: would run the {mode} ETL of {saveFilePath} writing {', '.join(get_run_outputs(sourceConfig))}")
+    if config.get('sources') and args.stage != 'download':
+        print(f"Dry run: would write the combined results to {config.get('resultOutputFilePath')}")
+
+# Function to parse the command line arguments
+"""
+    :param argv: list of arguments, defaults to sys.argv
+    :return: parsed arguments
+"""
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Hello Fresh recipes ETL")
+    parser.add_argument('--config', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json'),
+                        help="path of the config file, defaults to config.json next to main.py")
+    parser.add_argument('--dry-run', action='store_true', help="print what the run would download and write without doing it")
+    parser.add_argument('--stage', choices=['download', 'etl'], default=None,
+                        help="only download the source file, or only run the ETL of the local copy")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes, overrides 'workers' in config.json")
+    parser.add_argument('--full-rebuild', action='store_true', help="ignore the incremental state and reprocess the whole file")
+    parser.add_argument('--profile-stage', default=None, help="run this stage under cProfile and tracemalloc, overrides 'profileStage' in config.json")
+    parser.add_argument('--sample', type=int, default=None, help="classify this many random recipes of the downloaded file and print a summary instead of running the ETL")
+    return parser.parse_args(argv)
+
+# Function to run the ETL as configured
+"""
+    :param config: config object
+    :param args: parsed command line arguments
+"""
+def run_etl(config, args):
+    # Invalid thresholds fail the run before anything is downloaded
+    for sourceConfig in (get_source_configs(config) if config.get('sources') else [config]):
+        get_difficulty_thresholds(sourceConfig)
+
+    # Several feeds in one config are downloaded concurrently and processed in a process pool
+    if config.get('sources') and args.stage != 'download':
+        run_sources_etl(config, args.workers or config.get('workers'), args.stage != 'etl', args.full_rebuild)
+        return
+
+    # URL of the file to download
+    sourceFileUrl = config.get('sourceFileUrl')
+    # Path where you want to save the downloaded file
+    saveFilePath = config.get('saveFilePath')
+    # output path
+    chileOutputFilePath = config.get('chileOutputFilePath')
+    # Results path
+    resultOutputFilePath = config.get('resultOutputFilePath')
+
+    # Difficulty thresholds in minutes
+    thresholds = get_difficulty_thresholds(config)
+
+    # JSON decoding backend, record fields to keep and lines decoded at once
+    decodeOptions = get_decode_options(config)
+
+    # Parquet or feather files written next to the csv files, None for csv only
+    columnarOptions = get_columnar_options(config)
+
+    # Field identifying a recipe for de-duplication, None compares whole recipes
+    dedupeKey = config.get('dedupeKey')
+
+    # Number of distinct durations remembered across chunks
+    configure_duration_memo(config.get('durationMemoSize', 10000))
+
+    # Percentiles of total_time written to the results besides the averages
+    configure_result_percentiles(config.get('resultPercentiles'), config.get('percentileExactLimit', 1000), config.get('percentileBinMinutes', 1))
+
+    rangeWorkers = config.get('downloadWorkers', 1)
+
+    # Only download the source files
+    if args.stage == 'download':
+        session = create_http_session(max(rangeWorkers, 1))
+        for sourceConfig in (get_source_configs(config) if config.get('sources') else [config]):
+            with track_stage('download'):
+                download_source_file(sourceConfig, session)
+        return
+
+    # Stamp of the last successful run, see is_run_up_to_date
+    stampFilePath = get_run_stamp_path(saveFilePath)
+
+    # Process the file while it downloads, the local copy is only used when it did not change upstream
+    if args.stage == 'etl':
+        print(f"Processing the local copy '{saveFilePath}' without downloading it.")
+    elif config.get('streamDownload', False):
+        session = create_http_session(max(rangeWorkers, 1))
+        try:
+            streamed = run_download_streaming_etl(sourceFileUrl, saveFilePath, chileOutputFilePath, resultOutputFilePath, session,
+                                                  config.get('chunkSize', 10000), thresholds, config.get('downloadChunkSize', 8192),
+                                                  config.get('cacheDownload', True), decodeOptions, columnarOptions, dedupeKey)
+        except BaseException:
+            # Some outputs may already be replaced, the next run must not be skipped
+            if os.path.isfile(stampFilePath):
+                os.remove(stampFilePath)
+            raise
+        if streamed:
+            # The local copy is the streamed body, so the next run can be skipped while it does not change
+            if config.get('cacheDownload', True):
+                save_etl_state(stampFilePath, get_run_stamp(config, saveFilePath))
+            elif os.path.isfile(stampFilePath):
+                os.remove(stampFilePath)
+            return
+        print(f"The file '{saveFilePath}' did not change upstream, processing the local copy.")
+    else:
+        session = create_http_session(max(rangeWorkers, 1))
+        # Download the file, an existing file is only downloaded again if it changed upstream
+        # A failed download raises, the ETL does not run and the stamp of the last run is kept
+        with track_stage('download'):
+            download_source_file(config, session)
+
+    # Quick check of the downloaded file, only the sampled lines are read
+    if args.sample:
+        print_sample_summary(saveFilePath, args.sample, thresholds, decodeOptions)
+        return
+
+    # Nothing to do when the outputs were written from the same file with the same config, e.g. after a 304 response
+    if not args.full_rebuild and is_run_up_to_date(config, saveFilePath):
+        print(f"The file '{saveFilePath}' and the config did not change since the last run, the outputs are up to date.")
+        return
+    # The stamp is only written back once this run succeeded
+    if os.path.isfile(stampFilePath):
+        os.remove(stampFilePath)
+
+    # Number of worker processes, more than one splits the file into shards
+    workers = args.workers or config.get('workers', 1)
+
+    # Several ingredient patterns are matched in a single read, one csv is written per ingredient
+    if config.get('ingredientPatterns'):
+        run_multi_ingredient_etl(saveFilePath, config['ingredientPatterns'], config.get('chunkSize', 10000), thresholds, decodeOptions, columnarOptions,
+                                 dedupeKey)
+    elif workers > 1:
+        run_sharded_etl(saveFilePath, chileOutputFilePath, resultOutputFilePath, workers, thresholds, decodeOptions, columnarOptions, dedupeKey)
+    else:
+        run_file_etl(config, saveFilePath, chileOutputFilePath, resultOutputFilePath, args.full_rebuild)
+    save_etl_state(stampFilePath, get_run_stamp(config, saveFilePath))
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("** Starting ETL process for Hello Fresh ** ",datetime.datetime.now())
+    # read config file
+    config = read_configs(args.config)
+
+    if args.dry_run:
+        print_dry_run(config, args)
+        return
+
+    # Every stage is measured, the metrics are emitted as JSON lines at the end of the run
+    start_run_metrics(args.profile_stage or config.get('profileStage'))
+    try:
+        run_etl(config, args)
+    finally:
+        emit_run_metrics(config.get('metricsFilePath'), config.get('profileOutputPath'))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -3,6 +3,12 @@ import json
 import numpy as np
 from unittest.mock import patch, mock_open, MagicMock
 import os
+import subprocess
+import sys
+import time
+import http.server
+import threading
+import multiprocessing
 from src.main import *
 
 # Function to read the config file
@@ -22,7 +28,8 @@ Summary of Changes: for download_file
 # Test for a successful file download
 @patch('src.main.requests.get')  # Mocking requests.get
 @patch('builtins.open', new_callable=mock_open)
-def test_download_file_success(mock_file, mock_get):
+@patch('os.replace')
+def test_download_file_success(mock_replace, mock_file, mock_get):
     # Mock response object with iter_content method
     mock_response = MagicMock()
     mock_response.iter_content = MagicMock(return_value=[b'test data'])
@@ -36,8 +43,9 @@ def test_download_file_success(mock_file, mock_get):
     # Call the function
     result = download_file(url, save_path)
 
-    # Check if the file was opened in write-binary mode
-    mock_file.assert_called_with(save_path, 'wb')
+    # Check if the file was downloaded in write-binary mode next to the local copy, and moved over it once complete
+    mock_file.assert_called_with(save_path + '.part', 'wb')
+    mock_replace.assert_called_with(save_path + '.part', save_path)
 
     # Check if write was called with the correct data
     mock_file().write.assert_called_with(b'test data')
@@ -334,4 +342,957 @@ def test_nan_in_prep_time():
 def test_nan_in_both_times():
     difficulty, total_time = calculate_difficulty(np.nan, np.nan)
     assert difficulty == 'Unknown Difficulty'
-    assert np.isnan(total_time)
\ No newline at end of file
+    assert np.isnan(total_time)
+
+# Unit test to check that iter_chilies_recipes lazily filters an iterable without building a list
+def test_iter_chilies_recipes_is_lazy():
+    recipes = iter([
+        {'name': 'Recipe 1', 'ingredients': 'Chili powder'},
+        {'name': 'Recipe 2', 'ingredients': 'Garlic'}
+    ])
+
+    result = iter_chilies_recipes(recipes)
+
+    assert not isinstance(result, list)
+    assert next(result)['name'] == 'Recipe 1'
+    assert list(result) == []
+
+# Unit test to check that stats of several chunks merge into the same averages as a single pass
+def test_merge_difficulty_stats():
+    stats = merge_difficulty_stats({'Easy': {'sum': 10.0, 'count': 2}}, {'Easy': {'sum': 20.0, 'count': 1}, 'Hard': {'sum': 90.0, 'count': 1}})
+
+    assert stats == {'Easy': {'sum': 30.0, 'count': 3}, 'Hard': {'sum': 90.0, 'count': 1}}
+
+# Helper to write a small recipes jsonl file used by the end to end tests
+def write_sample_recipes(filePath):
+    recipes = [
+        {'name': 'Recipe 1', 'ingredients': 'Chili powder', 'url': 'http://a', 'cookTime': 'PT10M', 'prepTime': 'PT5M', 'description': 'First\nline'},
+        {'name': 'Recipe 2', 'ingredients': 'Garlic', 'url': 'http://b', 'cookTime': 'PT1H', 'prepTime': 'PT5M', 'description': 'No chili'},
+        {'name': 'Recipe 3', 'ingredients': 'Green chiles', 'url': 'http://c', 'cookTime': 'PT1H', 'prepTime': 'PT5M', 'description': 'Hard one'},
+        {'name': 'Recipe 4', 'ingredients': 'Chilies', 'url': 'http://d', 'cookTime': 'PT20M', 'prepTime': 'PT15M', 'description': 'Medium one'},
+        {'name': 'Recipe 1', 'ingredients': 'Chili powder', 'url': 'http://a', 'cookTime': 'PT10M', 'prepTime': 'PT5M', 'description': 'First\nline'}
+    ]
+    with open(filePath, 'w', encoding='utf-8') as file:
+        for recipe in recipes:
+            file.write(json.dumps(recipe) + '\n')
+
+# Unit test to check that the streaming ETL writes the same outputs as the in-memory ETL
+def test_run_streaming_etl_matches_batch(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    run_streaming_etl(source, str(tmp_path / 'stream_chilies.csv'), str(tmp_path / 'stream_results.csv'), chunkSize=1)
+
+    assert (tmp_path / 'stream_chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert (tmp_path / 'stream_results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+# Unit test to check that the column based duration parser agrees with convert_duration_to_minutes
+def test_convert_durations_to_minutes_matches_scalar():
+    durations = ['PT2H', 'PT45M', 'PT1H30M', 'PT0S', '', 'P1DT2H', 'PT1.5H', 'PT45M']
+
+    minutes, invalid_rows = convert_durations_to_minutes(durations)
+
+    assert minutes.dtype == np.float64
+    assert list(minutes) == [convert_duration_to_minutes(duration) for duration in durations]
+    assert len(invalid_rows) == 0
+
+# Unit test to check that invalid durations are reported per row instead of aborting the column
+def test_convert_durations_to_minutes_reports_invalid_rows():
+    durations = pd.Series(['PT10M', 'ten minutes', None, 'PT5M'], index=[10, 11, 12, 13])
+
+    minutes, invalid_rows = convert_durations_to_minutes(durations, errors='coerce')
+
+    assert list(invalid_rows) == [11, 12]
+    assert minutes[0] == 10 and minutes[3] == 5
+    assert np.isnan(minutes[1]) and np.isnan(minutes[2])
+
+    with pytest.raises(ValueError, match="Invalid duration format"):
+        convert_durations_to_minutes(durations)
+
+# Unit test to check that the column based difficulty agrees with calculate_difficulty, including the boundaries and NaN
+def test_calculate_difficulty_columns_matches_scalar():
+    cook = np.array([10, 20, 50, 15, 30, np.nan, 10])
+    prep = np.array([15, 15, 20, 15, 31, 10, np.nan])
+
+    difficulty, total_time = calculate_difficulty_columns(cook, prep)
+
+    expected = [calculate_difficulty(c, p) for c, p in zip(cook, prep)]
+    assert list(difficulty) == [level for level, _ in expected]
+    np.testing.assert_array_equal(total_time, [total for _, total in expected])
+
+# Unit test to check that the difficulty thresholds can be configured
+def test_calculate_difficulty_columns_custom_thresholds():
+    difficulty, _ = calculate_difficulty_columns([5, 10, 30], [5, 10, 30], {'hard': 40, 'medium': 20})
+
+    assert list(difficulty) == ['Easy', 'Medium', 'Hard']
+    assert calculate_difficulty(10, 10, {'hard': 40, 'medium': 20}) == ('Medium', 20)
+
+# Unit test to check that a partial threshold override keeps the other default and that invalid thresholds fail the run early
+def test_get_difficulty_thresholds(tmp_path):
+    assert get_difficulty_thresholds({}) == DEFAULT_DIFFICULTY_THRESHOLDS
+    assert get_difficulty_thresholds({'difficultyThresholds': {'hard': 90}}) == {'hard': 90, 'medium': 30}
+    for thresholds, message in (({'hard': 20}, 'must not be above hard'), ({'medium': 70, 'hard': 60}, 'must not be above hard'),
+                                ({'easy': 10}, 'Unknown difficultyThresholds easy'), ({'hard': '60'}, 'must be numbers')):
+        with pytest.raises(ValueError, match=message):
+            get_difficulty_thresholds({'difficultyThresholds': thresholds})
+
+    # A source with invalid thresholds fails the run before anything is downloaded
+    config = {'sourceFileUrl': 'http://127.0.0.1:1/recipes.json', 'saveFilePath': str(tmp_path / 'recipes.json'),
+              'chileOutputFilePath': str(tmp_path / 'Chilies.csv'), 'resultOutputFilePath': str(tmp_path / 'Results.csv')}
+    with patch('src.main.download_source_file') as download, pytest.raises(ValueError, match='must not be above hard'):
+        run_etl({'sources': [dict(config, difficultyThresholds={'medium': 90})], 'resultOutputFilePath': str(tmp_path / 'Combined.csv')},
+                parse_args([]))
+    download.assert_not_called()
+
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    main_config = dict(config, difficultyThresholds={'hard': 70})
+    (tmp_path / 'config.json').write_text(json.dumps(main_config))
+    main(['--config', str(tmp_path / 'config.json'), '--stage', 'etl'])
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'), thresholds={'hard': 70, 'medium': 30})
+    assert (tmp_path / 'Results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+# Unit test to check that shards start on line boundaries and cover the whole file exactly once
+def test_compute_shard_offsets_aligned_on_lines(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+
+    shards = compute_shard_offsets(source, 3)
+
+    with open(source, 'rb') as file:
+        content = file.read()
+    assert shards[0][0] == 0 and shards[-1][1] == len(content)
+    assert all(end == next_start for (_, end), (next_start, _) in zip(shards, shards[1:]))
+    assert all(content[start - 1:start] == b'\n' for start, _ in shards[1:])
+    assert sum(len(list(iter_json_byte_range(source, start, end))) for start, end in shards) == 5
+
+# Unit test to check that the sharded ETL writes the same outputs as the in-memory ETL
+def test_run_sharded_etl_matches_batch(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    run_sharded_etl(source, str(tmp_path / 'shard_chilies.csv'), str(tmp_path / 'shard_results.csv'), workers=2)
+
+    assert (tmp_path / 'shard_chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert (tmp_path / 'shard_results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+# Unit test to check that every mode averages unique recipes only, also with duplicates and keyless recipes across shards
+def test_results_average_unique_recipes(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    recipes = [
+        {'name': 'Recipe A', 'ingredients': 'Chili powder', 'url': 'http://a', 'cookTime': 'PT10M', 'prepTime': 'PT5M'},
+        {'name': 'Recipe C', 'ingredients': 'Green chiles', 'cookTime': 'PT1H', 'prepTime': 'PT5M'},
+        {'name': 'Recipe B', 'ingredients': 'Chili flakes', 'url': 'http://b', 'cookTime': 'PT20M', 'prepTime': 'PT5M'},
+        {'name': 'Recipe D', 'ingredients': 'Red chiles', 'cookTime': 'PT1H10M', 'prepTime': 'PT5M'},
+        {'name': 'Recipe A', 'ingredients': 'Chili powder', 'url': 'http://a', 'cookTime': 'PT10M', 'prepTime': 'PT5M'}
+    ]
+    with open(source, 'w', encoding='utf-8') as file:
+        for recipe in recipes:
+            file.write(json.dumps(recipe) + '\n')
+    # The duplicate of Recipe A is dropped, the keyless Recipe C and Recipe D are both kept
+    expected = "Easy|average_total_time|20.0\nHard|average_total_time|70.0\n"
+
+    for dedupeKey in (None, 'url'):
+        run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'), dedupeKey=dedupeKey)
+        run_streaming_etl(source, str(tmp_path / 'stream_chilies.csv'), str(tmp_path / 'stream_results.csv'), chunkSize=1, dedupeKey=dedupeKey)
+        run_sharded_etl(source, str(tmp_path / 'shard_chilies.csv'), str(tmp_path / 'shard_results.csv'), workers=2, dedupeKey=dedupeKey)
+        run_incremental_etl(source, str(tmp_path / 'inc_chilies.csv'), str(tmp_path / 'inc_results.csv'), str(tmp_path / 'state.json'),
+                            fullRebuild=True, dedupeKey=dedupeKey)
+
+        for mode in ('batch', 'stream', 'shard', 'inc'):
+            assert (tmp_path / f'{mode}_results.csv').read_text() == expected, mode
+            assert len((tmp_path / f'{mode}_chilies.csv').read_text().splitlines()) == 5, mode
+
+# Unit test to check that a dedupeKey no recipe has keeps every recipe in every mode, also across shards
+def test_results_missing_dedupe_key(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    with open(source, 'w', encoding='utf-8') as file:
+        for _ in range(40):
+            file.write(json.dumps({'name': 'Recipe A', 'ingredients': 'Chili powder', 'cookTime': 'PT10M', 'prepTime': 'PT5M'}) + '\n')
+
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'), dedupeKey='url')
+    run_sharded_etl(source, str(tmp_path / 'shard_chilies.csv'), str(tmp_path / 'shard_results.csv'), workers=2, dedupeKey='url')
+    assert len((tmp_path / 'batch_chilies.csv').read_text().splitlines()) == 41
+    assert (tmp_path / 'shard_chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert (tmp_path / 'shard_results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+# Unit test to check that a rerun of the incremental ETL only processes appended lines and keeps exact averages
+def test_run_incremental_etl_processes_only_new_lines(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    with open(source, 'r') as file:
+        lines = file.readlines()
+    with open(source, 'w') as file:
+        file.writelines(lines[:2])
+
+    outputs = (str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), str(tmp_path / 'state.json'))
+    run_incremental_etl(source, *outputs)
+    assert (tmp_path / 'results.csv').read_text() == "Easy|average_total_time|15.0\n"
+
+    with open(source, 'a') as file:
+        file.writelines(lines[2:4])
+    run_incremental_etl(source, *outputs)
+
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    assert (tmp_path / 'results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+    assert (tmp_path / 'chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert load_etl_state(outputs[2])['offset'] == os.path.getsize(source)
+
+# Unit test to check that a recipe written by an earlier increment is dropped when it is appended again, also in a new process
+def test_run_incremental_etl_dedupes_across_runs(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    with open(source, 'r') as file:
+        lines = file.readlines()
+    with open(source, 'w') as file:
+        file.writelines(lines[:4])
+    outputs = (str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), str(tmp_path / 'state.json'))
+    run_incremental_etl(source, *outputs, dedupeKey='url')
+
+    # The duplicate of Recipe 1 is appended by a later run in another process, with another string hash seed
+    with open(source, 'a') as file:
+        file.writelines(lines[4:])
+    script = ("import runpy, sys; etl = runpy.run_path(sys.argv[1]); etl['run_incremental_etl'](*sys.argv[2:], dedupeKey='url')")
+    subprocess.run([sys.executable, '-c', script, sys.modules[run_incremental_etl.__module__].__file__, source, *outputs],
+                   check=True, env=dict(os.environ, PYTHONHASHSEED='123'))
+
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'), dedupeKey='url')
+    assert (tmp_path / 'chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert load_etl_state(outputs[2])['offset'] == os.path.getsize(source)
+    assert len((tmp_path / 'state.json.hashes').read_text().split()) == 2
+
+    # Another dedupeKey does not fit the persisted hashes
+    run_incremental_etl(source, *outputs)
+    assert load_etl_state(outputs[2])['dedupeKey'] is None
+
+# Unit test to check that an increment appends to the csv and the hashes in place, and that rows of a failed run are cut off
+def test_run_incremental_etl_appends_in_place(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    with open(source, 'r') as file:
+        lines = file.readlines()
+    with open(source, 'w') as file:
+        file.writelines(lines[:2])
+    outputs = (str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), str(tmp_path / 'state.json'))
+    run_incremental_etl(source, *outputs)
+    first_csv = (tmp_path / 'chilies.csv').read_text()
+    first_hashes = (tmp_path / 'state.json.hashes').read_text()
+    state = load_etl_state(outputs[2])
+    assert state['csvSize'] == os.path.getsize(outputs[0]) and state['hashesSize'] == len(first_hashes)
+
+    # The previous rows are neither copied nor rewritten
+    with open(source, 'a') as file:
+        file.writelines(lines[2:4])
+    with patch('src.main.shutil.copyfile') as copyfile:
+        run_incremental_etl(source, *outputs)
+    copyfile.assert_not_called()
+    csv = (tmp_path / 'chilies.csv').read_text()
+    assert csv.startswith(first_csv) and csv != first_csv
+    assert (tmp_path / 'state.json.hashes').read_text().startswith(first_hashes)
+    assert not (tmp_path / 'chilies.csv.tmp').exists()
+
+    # A failed increment truncates the csv back to its previous size
+    def failing_recipes():
+        yield {'name': 'Recipe 9', 'ingredients': 'Chili', 'url': 'http://i', 'cookTime': 'PT5M', 'prepTime': 'PT5M'}
+        raise OSError("connection reset")
+    with pytest.raises(OSError):
+        write_chilies_chunks(failing_recipes(), outputs[0], {}, chunkSize=1, columns=state['columns'])
+    assert (tmp_path / 'chilies.csv').read_text() == csv
+
+    # Rows and hashes left by a run killed before it saved the state are cut off by the next run
+    hashes = (tmp_path / 'state.json.hashes').read_text()
+    with open(outputs[0], 'a') as file:
+        file.write('Recipe 9|Chili\n')
+    with open(outputs[2] + '.hashes', 'a') as file:
+        file.write('0123456789abcdef\n')
+    with open(source, 'a') as file:
+        file.writelines(lines[4:])
+    run_incremental_etl(source, *outputs)
+    assert (tmp_path / 'chilies.csv').read_text() == csv
+    assert (tmp_path / 'state.json.hashes').read_text() == hashes
+
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    assert (tmp_path / 'results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+    # A csv shorter than saved in the state is rebuilt
+    with open(outputs[0], 'w') as file:
+        file.write(first_csv)
+    run_incremental_etl(source, *outputs)
+    assert (tmp_path / 'chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+
+# Unit test to check that a rewritten source file invalidates the watermark
+def test_run_incremental_etl_rebuilds_rewritten_source(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    outputs = (str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), str(tmp_path / 'state.json'))
+    run_incremental_etl(source, *outputs)
+
+    with open(source, 'r') as file:
+        content = file.read()
+    with open(source, 'w') as file:
+        file.write(content.replace('PT10M', 'PT50M') + '\n')
+
+    assert not is_watermark_valid(source, load_etl_state(outputs[2]))
+    run_incremental_etl(source, *outputs)
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    assert (tmp_path / 'results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+# Local stand-in for the recipes HTTP server with ETag, conditional request and Range support
+class RecipesRequestHandler(http.server.BaseHTTPRequestHandler):
+    body = b'{"name": "Recipe 1"}\n' * 1000
+    etag = '"v1"'
+    requests_seen = []
+    # Number of bytes sent before the connection is closed, None sends the whole body
+    sendBytes = None
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        type(self).requests_seen.append((self.command, self.headers.get('Range')))
+        if self.headers.get('If-None-Match') == self.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        body, status = self.body, 200
+        byte_range = self.headers.get('Range')
+        if byte_range and self.headers.get('If-Range', self.etag) == self.etag:
+            start, end = byte_range.split('=')[1].split('-')
+            body, status = self.body[int(start):int(end) + 1 if end else None], 206
+        self.send_response(status)
+        self.send_header('ETag', self.etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body[:self.sendBytes])
+            if self.sendBytes is not None:
+                self.close_connection = True
+
+@pytest.fixture
+def recipes_server():
+    RecipesRequestHandler.requests_seen = []
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), RecipesRequestHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/recipes.json"
+    server.shutdown()
+    server.server_close()
+
+# Test that a second download of an unchanged file costs a single conditional request
+def test_download_file_conditional_request(tmp_path, recipes_server):
+    save_path = str(tmp_path / 'recipes.json')
+
+    assert download_file(recipes_server, save_path) == f"File downloaded successfully and saved to {save_path}"
+    assert download_file(recipes_server, save_path) == f"File not modified, keeping {save_path}"
+
+    assert len(RecipesRequestHandler.requests_seen) == 2
+    assert (tmp_path / 'recipes.json').read_bytes() == RecipesRequestHandler.body
+
+# Test that an interrupted download is resumed with a Range request
+def test_download_file_resumes_interrupted_download(tmp_path, recipes_server):
+    save_path = str(tmp_path / 'recipes.json')
+    (tmp_path / 'recipes.json.part').write_bytes(RecipesRequestHandler.body[:5000])
+    save_download_meta(save_path + '.part', {'url': recipes_server, 'etag': RecipesRequestHandler.etag, 'lastModified': None, 'complete': False})
+
+    download_file(recipes_server, save_path, chunkSize=1024)
+
+    assert RecipesRequestHandler.requests_seen == [('GET', 'bytes=5000-')]
+    assert (tmp_path / 'recipes.json').read_bytes() == RecipesRequestHandler.body
+    assert load_download_meta(save_path)['complete']
+    assert not (tmp_path / 'recipes.json.part').exists()
+
+# Test that a download cut off by the server keeps the previous local copy, fails the run and is resumed by the next one
+def test_download_file_keeps_local_copy_on_failure(tmp_path, recipes_server):
+    save_path = str(tmp_path / 'recipes.json')
+    download_file(recipes_server, save_path)
+    with patch.object(RecipesRequestHandler, 'body', RecipesRequestHandler.body * 2), patch.object(RecipesRequestHandler, 'etag', '"v2"'):
+        with patch.object(RecipesRequestHandler, 'sendBytes', 15000):
+            assert download_file(recipes_server, save_path).startswith("An error occurred")
+        assert (tmp_path / 'recipes.json').read_bytes() == RecipesRequestHandler.body[:21000]
+        # Bytes received before the connection closed are kept to be resumed
+        part_size = (tmp_path / 'recipes.json.part').stat().st_size
+        assert 0 < part_size <= 15000
+
+        config = {'sourceFileUrl': recipes_server, 'saveFilePath': save_path, 'chileOutputFilePath': str(tmp_path / 'Chilies.csv'),
+                  'resultOutputFilePath': str(tmp_path / 'Results.csv')}
+        (tmp_path / 'config.json').write_text(json.dumps(config))
+        with patch.object(RecipesRequestHandler, 'sendBytes', 15000), pytest.raises(ValueError, match="is skipped"):
+            main(['--config', str(tmp_path / 'config.json')])
+        assert not (tmp_path / 'Chilies.csv').exists() and not (tmp_path / 'recipes.json.run.json').exists()
+
+        # The failed run resumed the .part file too
+        part_size = (tmp_path / 'recipes.json.part').stat().st_size
+        RecipesRequestHandler.requests_seen = []
+        assert download_file(recipes_server, save_path) == f"File downloaded successfully and saved to {save_path}"
+        assert RecipesRequestHandler.requests_seen[-1] == ('GET', f'bytes={part_size}-')
+        assert (tmp_path / 'recipes.json').read_bytes() == RecipesRequestHandler.body
+
+# Test that a large file is fetched as parallel ranges over a pooled session
+def test_download_file_parallel_ranges(tmp_path, recipes_server):
+    save_path = str(tmp_path / 'recipes.json')
+
+    result = download_file(recipes_server, save_path, session=create_http_session(4), rangeWorkers=4, rangeSize=4096)
+
+    assert result == f"File downloaded successfully and saved to {save_path}"
+    assert (tmp_path / 'recipes.json').read_bytes() == RecipesRequestHandler.body
+    assert sum(1 for method, byte_range in RecipesRequestHandler.requests_seen if byte_range) == 6
+
+# Test that every source is downloaded and processed on its own and that the combined results merge their stats
+def test_run_sources_etl(tmp_path, recipes_server):
+    write_sample_recipes(str(tmp_path / 'sample.json'))
+    run_batch_etl(str(tmp_path / 'sample.json'), str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    sources = [{'name': name, 'sourceFileUrl': recipes_server.replace('recipes.json', name + '.json'), 'saveFilePath': str(tmp_path / (name + '.json')),
+                'chileOutputFilePath': str(tmp_path / (name + '_Chilies.csv'))} for name in ('a', 'b')]
+    config = {'sources': sources, 'resultOutputFilePath': str(tmp_path / 'Results.csv'), 'streaming': True, 'chunkSize': 2}
+
+    with patch.object(RecipesRequestHandler, 'body', (tmp_path / 'sample.json').read_bytes()):
+        stats = run_sources_etl(config, workers=2)
+
+    assert stats == {'Easy': {'sum': 30.0, 'count': 2}, 'Hard': {'sum': 130.0, 'count': 2}}
+    for name in ('a', 'b'):
+        assert (tmp_path / (name + '_Chilies.csv')).read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+        assert (tmp_path / (name + '_Chilies_Results.csv')).read_text() == (tmp_path / 'batch_results.csv').read_text()
+    assert (tmp_path / 'Results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+    # A source that cannot be downloaded fails the run once the other sources are written
+    config['sources'].append({'name': 'c', 'sourceFileUrl': 'http://127.0.0.1:1/c.json', 'saveFilePath': str(tmp_path / 'c.json'),
+                              'chileOutputFilePath': str(tmp_path / 'c_Chilies.csv')})
+    with pytest.raises(ValueError, match="sources: c"):
+        run_sources_etl(config, workers=2)
+    assert (tmp_path / 'Results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+
+# Test that an unchanged source is skipped and its stamped stats still count in the combined results
+def test_run_sources_etl_skips_unchanged_sources(tmp_path):
+    sources = []
+    for name in ('a', 'b'):
+        write_sample_recipes(str(tmp_path / (name + '.json')))
+        sources.append({'name': name, 'sourceFileUrl': 'http://127.0.0.1:1/' + name, 'saveFilePath': str(tmp_path / (name + '.json')),
+                        'chileOutputFilePath': str(tmp_path / (name + '_Chilies.csv'))})
+    config = {'sources': sources, 'resultOutputFilePath': str(tmp_path / 'Results.csv'), 'streaming': True}
+    stats = run_sources_etl(config, workers=2, download=False)
+    written = {name: os.stat(tmp_path / (name + '_Chilies.csv')).st_mtime_ns for name in ('a', 'b')}
+
+    # Only the changed source is processed again
+    with open(tmp_path / 'b.json', 'a') as file:
+        file.write(json.dumps({'name': 'Recipe 6', 'ingredients': 'Chili', 'url': 'http://f', 'cookTime': 'PT40M', 'prepTime': 'PT5M'}) + '\n')
+    time.sleep(0.01)
+    (tmp_path / 'Results.csv').unlink()
+    assert run_sources_etl(config, workers=2, download=False) == {'Easy': {'sum': 30.0, 'count': 2}, 'Hard': {'sum': 130.0, 'count': 2},
+                                                                  'Medium': {'sum': 45.0, 'count': 1}}
+    assert os.stat(tmp_path / 'a_Chilies.csv').st_mtime_ns == written['a']
+    assert os.stat(tmp_path / 'b_Chilies.csv').st_mtime_ns != written['b']
+    assert (tmp_path / 'Results.csv').exists()
+
+    run_sources_etl(config, workers=2, download=False, fullRebuild=True)
+    assert os.stat(tmp_path / 'a_Chilies.csv').st_mtime_ns != written['a']
+
+# Test that lines are re-assembled across response chunks while the body is teed to disk
+def test_iter_response_lines_tees_body(tmp_path):
+    response = MagicMock()
+    response.iter_content = MagicMock(return_value=[b'{"a": 1}\n{"b"', b': 2}\n', b'{"c": 3}'])
+    tee_path = str(tmp_path / 'recipes.json')
+
+    lines = list(iter_response_lines(response, teeFilePath=tee_path))
+
+    assert lines == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+    assert (tmp_path / 'recipes.json').read_bytes() == b'{"a": 1}\n{"b": 2}\n{"c": 3}'
+    assert not os.path.exists(tee_path + '.tmp')
+
+# Test that processing the HTTP stream gives the same outputs as processing the downloaded file
+def test_run_download_streaming_etl_matches_batch(tmp_path, recipes_server, monkeypatch):
+    source = str(tmp_path / 'source.json')
+    write_sample_recipes(source)
+    with open(source, 'rb') as file:
+        monkeypatch.setattr(RecipesRequestHandler, 'body', file.read())
+    save_path = str(tmp_path / 'recipes.json')
+
+    streamed = run_download_streaming_etl(recipes_server, save_path, str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), downloadChunkSize=16)
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+
+    assert streamed
+    assert (tmp_path / 'chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert (tmp_path / 'results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+    assert (tmp_path / 'recipes.json').read_bytes() == RecipesRequestHandler.body
+    # The cached copy makes the next run a conditional request that streams nothing
+    assert not run_download_streaming_etl(recipes_server, save_path, str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'))
+
+# Unit test to check that every installed JSON backend decodes batches the same way and skips bad lines
+def test_iter_decoded_records_backends():
+    lines = [b'{"name": "Recipe 1", "ingredients": "Chili", "extra": [1, {"a": 2}]}\n', b'{bad json}\n', b'{"name": "Recipe 2", "ingredients": "Basil\\nLeaves"}\n']
+    expected = [{"name": "Recipe 1", "ingredients": "Chili", "extra": [1, {"a": 2}]}, {"name": "Recipe 2", "ingredients": "Basil\nLeaves"}]
+
+    backends = ['json'] + [name for name, module in [('orjson', orjson), ('simdjson', simdjson)] if module is not None]
+    for backend in backends:
+        assert list(iter_decoded_records(lines, backend=backend, batchSize=2)) == expected
+        assert list(iter_decoded_records([line.decode() for line in lines], backend=backend)) == expected
+
+# Unit test to check that records are projected to the pass-through fields plus the fields the pipeline needs
+def test_iter_decoded_records_projects_fields():
+    lines = ['{"name": "Recipe 1", "ingredients": "Chili", "cookTime": "PT5M", "prepTime": "", "image": "x.jpg"}']
+
+    for backend in ['json', 'auto']:
+        assert list(iter_decoded_records(lines, backend=backend, fields=['name'])) == [{"name": "Recipe 1", "ingredients": "Chili", "cookTime": "PT5M", "prepTime": ""}]
+
+# Unit test to check that the batch ETL reads through the configured decoder like the streaming ETL
+def test_run_batch_etl_uses_decode_options(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    decodeOptions = {'backend': 'json', 'fields': ['name', 'description'], 'batchSize': 2}
+
+    with patch('src.main.read_json_file') as read_json:
+        run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'), decodeOptions=decodeOptions)
+    read_json.assert_not_called()
+    run_streaming_etl(source, str(tmp_path / 'stream_chilies.csv'), str(tmp_path / 'stream_results.csv'), decodeOptions=decodeOptions)
+
+    assert (tmp_path / 'batch_chilies.csv').read_text() == (tmp_path / 'stream_chilies.csv').read_text()
+    assert (tmp_path / 'batch_chilies.csv').read_text().splitlines()[0] == 'name|ingredients|cookTime|prepTime|description|difficulty'
+    assert (tmp_path / 'batch_results.csv').read_text() == (tmp_path / 'stream_results.csv').read_text()
+
+# Unit test to check that new lines are only replaced in string values when the output is written
+def test_clean_newlines():
+    recipesDF = pd.DataFrame([{'name': 'Recipe\n1', 'servings': 2, 'description': None}, {'name': 'Recipe 2', 'servings': 4, 'description': 'a\nb'}])
+
+    cleanedDF = clean_newlines(recipesDF)
+
+    assert cleanedDF['name'].tolist() == ['Recipe 1', 'Recipe 2']
+    assert cleanedDF['description'].tolist()[1] == 'a b'
+    assert cleanedDF['servings'].tolist() == [2, 4]
+
+# Unit test to check that the matcher finds every configured ingredient and agrees with extract_chilies_recipes
+def test_build_ingredient_matcher():
+    matcher = build_ingredient_matcher({
+        'chilies': DEFAULT_INGREDIENT_PATTERNS['chilies'],
+        'garlic': {'pattern': r'\bgarlic\b', 'prefilter': 'garlic'},
+        'lime': {'pattern': r'\blimes?\b'}
+    })
+
+    assert matcher('Chili powder, cumin, and Garlic.') == {'chilies', 'garlic'}
+    assert matcher(['Chille', 'Lime']) == {'chilies', 'lime'}
+    assert matcher('Chilean sea bass, garlicky sauce') == set()
+    assert matcher(None) == set()
+
+    recipes = [{'ingredients': 'Chiles'}, {'ingredients': 'Basil'}, {'ingredients': ['Tomato', 'Chili powder']}, {'ingredients': 'Chilean wine'}]
+    chilies_matcher = build_ingredient_matcher()
+    assert [recipe for recipe, tags in iter_tagged_recipes(recipes, chilies_matcher)] == extract_chilies_recipes(recipes)
+
+# Unit test to check that tags whose words overlap are all found and that patterns with groups are rejected
+def test_build_ingredient_matcher_overlapping_tags():
+    matcher = build_ingredient_matcher({
+        'onion': {'pattern': r'\bonions?\b', 'prefilter': 'onion'},
+        'green onion': {'pattern': r'\bgreen onions?\b', 'prefilter': 'green onion'}
+    })
+    assert matcher('2 green onions') == {'onion', 'green onion'}
+    assert matcher('1 onion') == {'onion'}
+
+    matcher = build_ingredient_matcher({
+        'chilies': DEFAULT_INGREDIENT_PATTERNS['chilies'],
+        'chili powder': {'pattern': r'\bchili powder\b', 'prefilter': 'chili powder'}
+    })
+    assert matcher('Chili powder') == {'chilies', 'chili powder'}
+    assert matcher('Chilean wine') == set()
+
+    for pattern in (r'\bchil(l|e)?\b', r'\b(?P<word>\w+) (?P=word)\b', '(?i)garlic', '[garlic'):
+        with pytest.raises(ValueError):
+            build_ingredient_matcher({'chilies': DEFAULT_INGREDIENT_PATTERNS['chilies'], 'other': {'pattern': pattern}})
+
+# Unit test to check that one read of the file writes one csv per ingredient tag
+def test_run_multi_ingredient_etl(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    patterns = {
+        'chilies': dict(DEFAULT_INGREDIENT_PATTERNS['chilies'], outputFilePath=str(tmp_path / 'chilies.csv'), resultOutputFilePath=str(tmp_path / 'results.csv')),
+        'garlic': {'pattern': r'\bgarlic\b', 'prefilter': 'garlic', 'outputFilePath': str(tmp_path / 'garlic.csv')}
+    }
+
+    stats = run_multi_ingredient_etl(source, patterns, chunkSize=1)
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+
+    assert (tmp_path / 'chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert (tmp_path / 'results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+    assert stats['garlic'] == {'Hard': {'sum': 65.0, 'count': 1}}
+    assert len((tmp_path / 'garlic.csv').read_text().splitlines()) == 2
+
+# Unit test to check that nested stages are measured exclusively and emitted as JSON lines
+def test_track_stage_metrics(tmp_path):
+    start_run_metrics(profileStage='inner')
+    with track_stage('outer', 10) as counts:
+        counts['rowsOut'] = 5
+        for _ in range(2):
+            with track_stage('inner', 5):
+                time.sleep(0.02)
+    assert [chunk for chunk in iter_tracked([[1, 2], [3]], 'chunks')] == [[1, 2], [3]]
+
+    records = emit_run_metrics(str(tmp_path / 'metrics.jsonl'), str(tmp_path / 'inner.prof'))
+
+    by_stage = {record['stage']: record for record in records}
+    assert by_stage['outer']['rowsIn'] == 10 and by_stage['outer']['rowsOut'] == 5
+    assert by_stage['inner']['calls'] == 2 and by_stage['inner']['wallSeconds'] >= 0.04
+    assert by_stage['outer']['wallSeconds'] < by_stage['inner']['wallSeconds']
+    assert by_stage['chunks']['rowsOut'] == 3
+    assert 'tracemallocPeakMB' in by_stage['inner']
+    assert [json.loads(line)['stage'] for line in (tmp_path / 'metrics.jsonl').read_text().splitlines()] == ['outer', 'inner', 'chunks', 'total']
+    assert (tmp_path / 'inner.prof').exists()
+
+# Unit test to check that a stage reports how much it raised the peak RSS, not the peak of the process so far
+def test_track_stage_peak_rss_growth():
+    start_run_metrics()
+    with track_stage('allocate'):
+        block = b'x' * (300 * 1024 * 1024)
+        del block
+    with track_stage('small'):
+        pass
+    by_stage = {record['stage']: record for record in emit_run_metrics()}
+    assert by_stage['allocate']['peakRssGrowthMB'] > 100
+    assert by_stage['small']['peakRssGrowthMB'] == 0
+    assert by_stage['total']['peakRssMB'] > 300
+
+# Unit test to check that tracking is a no-op when no run metrics are collected
+def test_track_stage_without_metrics():
+    with track_stage('anything', 3) as counts:
+        counts['rowsOut'] = 3
+    assert emit_run_metrics() == []
+
+# Unit test to check that the parquet output has the rows of the csv with typed columns
+def test_run_streaming_etl_writes_parquet(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    columnarOptions = get_columnar_options({'outputFormat': 'parquet'})
+    run_streaming_etl(source, str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), chunkSize=1, columnarOptions=columnarOptions)
+
+    chiliesDF = pd.read_parquet(tmp_path / 'chilies.parquet')
+    assert len(chiliesDF) == len(pd.read_csv(tmp_path / 'chilies.csv', sep='|'))
+    assert list(chiliesDF['difficulty'].cat.categories) == DIFFICULTY_LEVELS
+    assert sorted(chiliesDF['total_time'].tolist()) == [15.0, 65.0]
+    resultsDF = pd.read_parquet(tmp_path / 'results.parquet', columns=['difficulty', 'total_time'])
+    assert resultsDF['difficulty'].tolist() == ['Easy', 'Hard']
+
+# Unit test to check that increments are appended to a dataset partitioned by difficulty
+def test_run_incremental_etl_appends_partitioned_feather(tmp_path):
+    pytest.importorskip('pyarrow')
+    import pyarrow.dataset
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    with open(source, 'r') as file:
+        lines = file.readlines()
+    with open(source, 'w') as file:
+        file.writelines(lines[:2])
+
+    columnarOptions = get_columnar_options({'outputFormat': 'feather', 'outputCompression': 'lz4', 'partitionByDifficulty': True})
+    outputs = (str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), str(tmp_path / 'state.json'))
+    run_incremental_etl(source, *outputs, columnarOptions=columnarOptions)
+    with open(source, 'a') as file:
+        file.writelines(lines[2:])
+    run_incremental_etl(source, *outputs, columnarOptions=columnarOptions)
+
+    assert sorted(os.listdir(tmp_path / 'chilies.feather')) == ['difficulty=Easy', 'difficulty=Hard']
+    dataset = pyarrow.dataset.dataset(str(tmp_path / 'chilies.feather'), format='feather', partitioning='hive')
+    # The second increment appends the duplicate of Recipe 1, which the first increment already wrote
+    assert dataset.count_rows() == len(pd.read_csv(tmp_path / 'chilies.csv', sep='|')) == 2
+
+# Unit test to check the columnar dtypes and that an unknown output format is rejected
+def test_get_columnar_options():
+    assert get_columnar_options({}) is None
+    columnarDF = to_columnar_frame(pd.DataFrame({'datePublished': ['2013-04-01', 'not a date'], 'difficulty': ['Hard', 'Easy']}))
+    assert pd.api.types.is_datetime64_any_dtype(columnarDF['datePublished']) and columnarDF['datePublished'].isna().tolist() == [False, True]
+    assert columnarDF['difficulty'].cat.categories.tolist() == DIFFICULTY_LEVELS
+    with pytest.raises(ValueError):
+        get_columnar_options({'outputFormat': 'xlsx'})
+
+# Unit test to check that a warm rerun reads the parse cache instead of decoding the file and writes the same outputs
+def test_run_cached_etl_skips_parsing(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    cacheDir = str(tmp_path / 'cache')
+    run_cached_etl(source, str(tmp_path / 'cold_chilies.csv'), str(tmp_path / 'cold_results.csv'), cacheDir)
+
+    with patch('src.main.iter_decoded_records', side_effect=AssertionError("the file should not be parsed")):
+        run_cached_etl(source, str(tmp_path / 'chilies.csv'), str(tmp_path / 'results.csv'), cacheDir, thresholds={'hard': 10, 'medium': 5})
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'), thresholds={'hard': 10, 'medium': 5})
+    assert (tmp_path / 'chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert (tmp_path / 'results.csv').read_text() == (tmp_path / 'batch_results.csv').read_text()
+    assert (tmp_path / 'cold_chilies.csv').read_text() != (tmp_path / 'chilies.csv').read_text()
+
+# Unit test to check that the parse cache keeps the most recently used source files within its size
+def test_read_parsed_recipes_evicts_least_recently_used(tmp_path):
+    pytest.importorskip('pyarrow')
+    cacheDir = str(tmp_path / 'cache')
+    sources = []
+    for name in ['a.json', 'b.json']:
+        sources.append(str(tmp_path / name))
+        write_sample_recipes(sources[-1])
+        with open(sources[-1], 'a') as file:
+            file.write(json.dumps({'name': name, 'ingredients': 'Chili', 'cookTime': 'PT1M', 'prepTime': ''}) + '\n')
+        read_parsed_recipes(sources[-1], cacheDir)
+    entries = load_etl_state(os.path.join(cacheDir, 'index.json'))['entries']
+    assert len(entries) == 2
+
+    read_parsed_recipes(sources[0], cacheDir, cacheMaxBytes=max(entry['bytes'] for entry in entries.values()))
+    entries = load_etl_state(os.path.join(cacheDir, 'index.json'))['entries']
+    assert [entry['sourcePath'] for entry in entries.values()] == [os.path.abspath(sources[0])]
+    assert sorted(os.listdir(cacheDir)) == sorted([key + '.arrow' for key in entries] + ['index.json'])
+
+# Unit test to check that the line index is saved next to the file and rebuilt when lines are appended
+def test_load_line_index(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    with open(source, 'wb') as file:
+        file.write(b'{"a": 1}\n{"a": 22}\n{"a": 3}')
+    assert load_line_index(source).tolist() == [0, 9, 19, 27]
+    assert os.path.isfile(get_line_index_path(source))
+
+    with open(source, 'ab') as file:
+        file.write(b'\n{"a": 4}\n')
+    assert load_line_index(source).tolist() == [0, 9, 19, 28, 37]
+    assert [line.tobytes() for line in iter_mmap_lines(source, load_line_index(source), 1, 3)] == [b'{"a": 22}\n', b'{"a": 3}\n']
+
+# Unit test to check that line ranges and samples are read without scanning the file
+def test_read_line_range_and_sample_records(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    assert [record['name'] for record in read_line_range(source, 2, 4)] == ['Recipe 3', 'Recipe 4']
+
+    sample = sample_records(source, 3, seed=7)
+    assert len(sample) == 3 and sample == sample_records(source, 3, seed=7)
+    assert len(sample_records(source, 50)) == 5
+
+# Unit test to check that a sample of many lines maps the file once instead of once per line
+def test_sample_records_maps_file_once(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    with open(source, 'w') as file:
+        for number in range(2000):
+            file.write(json.dumps({'name': f'Recipe {number}'}) + '\n')
+
+    with patch('src.main.map_file', wraps=map_file) as mapped:
+        assert len(sample_records(source, 1500, seed=1)) == 1500
+        assert len(read_line_range(source, 0, 2000)) == 2000
+    assert mapped.call_count == 2
+
+# Unit test to check that duplicates are dropped while reading, on the whole recipe or on a key
+def test_iter_unique_recipes():
+    recipes = [{'url': 'a', 'name': 'One\nline'}, {'url': 'a', 'name': 'One line'}, {'url': 'a', 'name': 'Other', 'tags': ['x']},
+               {'url': 'b', 'name': 'Other', 'tags': ['x']}, {'name': 'No url'}, {'name': 'No url', 'url': None}]
+    assert [recipe['name'] for recipe in iter_unique_recipes(recipes)] == ['One\nline', 'Other', 'Other', 'No url']
+    assert [recipe['name'] for recipe in iter_unique_recipes(recipes, 'url')] == ['One\nline', 'Other', 'No url', 'No url']
+
+# Unit test to check the compact dtypes of classified recipes
+def test_classify_recipes_compact_dtypes():
+    recipesDF = classify_recipes(build_recipes_frame([{'name': 'A', 'cookTime': 'PT10M', 'prepTime': 'PT5M'},
+                                                      {'name': 'B', 'cookTime': 'PT1H', 'prepTime': 'PT5M'},
+                                                      {'name': 'C', 'cookTime': 'bad', 'prepTime': 'PT5M'}]))
+    assert recipesDF['difficulty'].tolist() == ['Easy', 'Hard']
+    assert recipesDF['difficulty'].cat.categories.tolist() == DIFFICULTY_LEVELS
+    assert recipesDF['cookTime_minutes'].dtype == np.float32 and recipesDF['total_time'].dtype == np.float64
+    assert pd.api.types.is_string_dtype(recipesDF['name'])
+
+# Unit test to check that parsed and invalid durations are remembered across calls, within the memo size
+def test_convert_durations_to_minutes_memo():
+    configure_duration_memo(maxSize=3)
+    start_run_metrics()
+    minutes, invalid_rows = convert_durations_to_minutes(['PT10M', 'P1W', 'bad', 'PT10M'], errors='coerce')
+    assert list(invalid_rows) == [2]
+
+    with patch('src.main.convert_duration_to_minutes', side_effect=AssertionError("the duration should come from the memo")):
+        minutes, invalid_rows = convert_durations_to_minutes(['bad', 'PT10M', 'P1W'], errors='coerce')
+    assert minutes[1:].tolist() == [10.0, 10080.0] and list(invalid_rows) == [0]
+
+    convert_durations_to_minutes(['PT1H'], errors='coerce')
+    assert list(DURATION_MEMO['minutes']) == ['PT10M', 'P1W', 'PT1H']
+    total = emit_run_metrics(os.devnull)[-1]
+    assert total['durationMemoHits'] == 3 and total['durationMemoMisses'] == 4
+    configure_duration_memo()
+
+# Test that a rerun on an unchanged file with the same config skips the ETL, in a fresh process without loading pandas
+def test_main_skips_unchanged_run(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    config = {'sourceFileUrl': 'http://127.0.0.1:1/recipes.json', 'saveFilePath': source,
+              'chileOutputFilePath': str(tmp_path / 'Chilies.csv'), 'resultOutputFilePath': str(tmp_path / 'Results.csv')}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    main(['--config', str(tmp_path / 'config.json'), '--stage', 'etl'])
+    assert is_run_up_to_date(config, source)
+    assert not is_run_up_to_date(dict(config, chunkSize=5), source)
+
+    script = ("import runpy, sys; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__'); "
+              "print('loaded:', [name for name in ('pandas.core', 'numpy.core', 'requests.sessions') if name in sys.modules])")
+    output = subprocess.run([sys.executable, '-c', script, sys.modules[main.__module__].__file__, '--config', str(tmp_path / 'config.json'), '--stage', 'etl'],
+                            capture_output=True, text=True, check=True).stdout
+    assert "the outputs are up to date" in output and "loaded: []" in output
+
+    # A changed source file is processed again
+    with open(source, 'a') as file:
+        file.write(json.dumps({'name': 'Recipe 6', 'ingredients': 'Chili', 'url': 'http://f', 'cookTime': 'PT40M', 'prepTime': 'PT5M'}) + '\n')
+    assert not is_run_up_to_date(config, source)
+
+# Test that an unchanged run with a columnar output format is skipped without importing pyarrow
+def test_main_skips_unchanged_columnar_run(tmp_path):
+    pytest.importorskip('pyarrow')
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    config = {'sourceFileUrl': 'http://127.0.0.1:1/recipes.json', 'saveFilePath': source, 'outputFormat': 'parquet',
+              'chileOutputFilePath': str(tmp_path / 'Chilies.csv'), 'resultOutputFilePath': str(tmp_path / 'Results.csv')}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    main(['--config', str(tmp_path / 'config.json'), '--stage', 'etl'])
+    assert (tmp_path / 'Chilies.parquet').exists()
+
+    script = ("import runpy, sys; sys.argv = sys.argv[1:]; runpy.run_path(sys.argv[0], run_name='__main__'); "
+              "print('loaded:', [name for name in ('pandas.core', 'numpy.core', 'pyarrow') if name in sys.modules])")
+    output = subprocess.run([sys.executable, '-c', script, sys.modules[main.__module__].__file__, '--config', str(tmp_path / 'config.json'), '--stage', 'etl'],
+                            capture_output=True, text=True, check=True).stdout
+    assert "the outputs are up to date" in output and "loaded: []" in output
+
+    with pytest.raises(ValueError, match="Unknown outputFormat 'orc'"):
+        get_columnar_options({'outputFormat': 'orc'})
+    with patch('importlib.util.find_spec', return_value=None), pytest.raises(ValueError, match='needs pyarrow'):
+        get_columnar_options(config)
+
+# Test that a dry run only prints the plan
+def test_main_dry_run(tmp_path, capsys):
+    config = {'sourceFileUrl': 'http://127.0.0.1:1/recipes.json', 'saveFilePath': str(tmp_path / 'recipes.json'),
+              'chileOutputFilePath': str(tmp_path / 'Chilies.csv'), 'resultOutputFilePath': str(tmp_path / 'Results.csv'), 'streaming': True}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    main(['--config', str(tmp_path / 'config.json'), '--dry-run'])
+
+    output = capsys.readouterr().out
+    assert f"would download http://127.0.0.1:1/recipes.json to {tmp_path / 'recipes.json'}" in output
+    assert f"would run the streaming ETL of {tmp_path / 'recipes.json'} writing {tmp_path / 'Chilies.csv'}, {tmp_path / 'Results.csv'}" in output
+    assert sorted(os.listdir(tmp_path)) == ['config.json']
+
+    # The sources runner runs the mode of every source, a download streamed run streams unless only the ETL runs
+    sources_config = {'sources': [dict(config, name='a')], 'resultOutputFilePath': str(tmp_path / 'Combined.csv'), 'workers': 2,
+                      'ingredientPatterns': {'garlic': {'pattern': r'\bgarlic\b', 'outputFilePath': str(tmp_path / 'garlic.csv')}}}
+    (tmp_path / 'config.json').write_text(json.dumps(sources_config))
+    main(['--config', str(tmp_path / 'config.json'), '--dry-run'])
+    assert f"would run the streaming ETL of {tmp_path / 'recipes.json'}" in capsys.readouterr().out
+
+    (tmp_path / 'config.json').write_text(json.dumps(dict(config, streamDownload=True)))
+    main(['--config', str(tmp_path / 'config.json'), '--dry-run'])
+    assert f"would run the download streaming ETL of {tmp_path / 'recipes.json'}" in capsys.readouterr().out
+    main(['--config', str(tmp_path / 'config.json'), '--dry-run', '--stage', 'etl'])
+    assert f"would run the streaming ETL of {tmp_path / 'recipes.json'}" in capsys.readouterr().out
+
+# Test that a run streamed from the download stamps the local copy, so the next run of the unchanged file is skipped
+def test_main_stamps_streamed_download(tmp_path, recipes_server, capsys):
+    write_sample_recipes(str(tmp_path / 'sample.json'))
+    config = {'sourceFileUrl': recipes_server, 'saveFilePath': str(tmp_path / 'recipes.json'), 'streamDownload': True,
+              'chileOutputFilePath': str(tmp_path / 'Chilies.csv'), 'resultOutputFilePath': str(tmp_path / 'Results.csv')}
+    (tmp_path / 'config.json').write_text(json.dumps(config))
+    with patch.object(RecipesRequestHandler, 'body', (tmp_path / 'sample.json').read_bytes()):
+        main(['--config', str(tmp_path / 'config.json')])
+        assert is_run_up_to_date(config, config['saveFilePath'])
+        capsys.readouterr()
+        main(['--config', str(tmp_path / 'config.json')])
+    assert "the outputs are up to date" in capsys.readouterr().out
+
+# Test that Chilies.csv is written in row batches through a temporary file, and that a failed run keeps the previous file
+def test_write_chilies_chunks_atomic(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+
+    with patch('src.main.CSV_BATCH_ROWS', 1):
+        run_streaming_etl(source, str(tmp_path / 'Chilies.csv'), str(tmp_path / 'Results.csv'), chunkSize=1)
+    assert (tmp_path / 'Chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+
+    def failing_recipes():
+        yield {'name': 'Recipe 9', 'ingredients': 'Chili', 'url': 'http://i', 'cookTime': 'PT5M', 'prepTime': 'PT5M'}
+        raise OSError("connection reset")
+    with pytest.raises(OSError):
+        write_chilies_chunks(failing_recipes(), str(tmp_path / 'Chilies.csv'), {}, chunkSize=1)
+    assert (tmp_path / 'Chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+    assert not (tmp_path / 'Chilies.csv.tmp').exists()
+
+# Unit test to check that a streamed recipe with a field missing from the header fails the run instead of losing the field
+def test_streaming_new_field_fails(tmp_path):
+    source = str(tmp_path / 'recipes.json')
+    with open(source, 'w') as file:
+        file.write(json.dumps({'name': 'Recipe 1', 'ingredients': 'Chili', 'cookTime': 'PT5M', 'prepTime': 'PT5M'}) + '\n')
+        file.write(json.dumps({'name': 'Recipe 2', 'ingredients': 'Chili', 'url': 'http://b', 'description': 'Hot',
+                               'cookTime': 'PT5M', 'prepTime': 'PT5M'}) + '\n')
+    run_batch_etl(source, str(tmp_path / 'batch_chilies.csv'), str(tmp_path / 'batch_results.csv'))
+    assert 'description' in (tmp_path / 'batch_chilies.csv').read_text()
+
+    with pytest.raises(ValueError, match='url, description'):
+        run_streaming_etl(source, str(tmp_path / 'Chilies.csv'), str(tmp_path / 'Results.csv'), chunkSize=1)
+    assert not (tmp_path / 'Chilies.csv').exists()
+    assert not (tmp_path / 'Chilies.csv.tmp').exists()
+
+    # With both recipes in one chunk the header has every field
+    run_streaming_etl(source, str(tmp_path / 'Chilies.csv'), str(tmp_path / 'Results.csv'), chunkSize=2)
+    assert (tmp_path / 'Chilies.csv').read_text() == (tmp_path / 'batch_chilies.csv').read_text()
+
+# Unit test to check that the substring prefilter never rejects a recipe the chili pattern matches, and skips the regex otherwise
+def test_has_chilies_prefilter():
+    for text in ['Chili powder', 'green CHILES', 'chilli oil', 'Garlic', 'chilaquiles', 'dried chıle', 'CHİLE', 'jalapeño', '']:
+        assert has_chilies(text) == (CHILI_PATTERN.search(text) is not None)
+    recipes = [{'ingredients': ['1 Chile', 'Garlic']}, {'ingredients': ['Chi', 'li']}]
+    assert extract_chilies_recipes(recipes) == [recipes[0]]
+
+# Unit test to document a known miss of the chili pattern kept from the original script: the plural "Chilies" is not matched
+def test_chili_pattern_misses_chilies():
+    assert CHILI_PATTERN.search('Chilies') is None
+    assert not has_chilies('Chilies')
+    assert extract_chilies_recipes([{'ingredients': ['Chilies']}]) == []
+
+    with patch('src.main.CHILI_PATTERN') as pattern:
+        assert not has_chilies('2 cups flour\n1 onion, diced')
+        pattern.search.assert_not_called()
+
+# Unit test to check that sketches give the same nearest rank percentiles in exact and histogram mode, merged or not
+def test_sketch_percentiles():
+    values = np.array([5.0, 15.0, 15.0, 20.0, 35.0, 45.0, 60.0, 90.0, 120.0, 480.0])
+    configure_result_percentiles([50, 95], exactLimit=100)
+    exact = add_to_sketch({'values': []}, values)
+    configure_result_percentiles([50, 95], exactLimit=3)
+    merged = merge_sketches(add_to_sketch({'values': []}, values[:6]), json.loads(json.dumps(add_to_sketch({'values': []}, values[6:]))))
+    assert 'values' in exact and 'bins' in merged
+    for sketch in (exact, merged):
+        assert [get_sketch_percentile(sketch, percentile, len(values)) for percentile in (10, 50, 95, 100)] == [5.0, 35.0, 480.0, 480.0]
+
+    # Values inside a bin are answered with the lower edge of their bin
+    configure_result_percentiles([50], exactLimit=0, binMinutes=10)
+    assert get_sketch_percentile(add_to_sketch({'values': []}, np.array([12.5, 17.5, 31.0])), 50, 3) == 12.5
+    configure_result_percentiles()
+
+# Test that counts and percentiles are written as extra results rows and survive merging the stats of shards
+def test_results_with_percentiles(tmp_path, capsys):
+    source = str(tmp_path / 'recipes.json')
+    write_sample_recipes(source)
+    configure_result_percentiles([50, 95])
+    try:
+        run_streaming_etl(source, str(tmp_path / 'Chilies.csv'), str(tmp_path / 'Results.csv'), chunkSize=1)
+        run_sharded_etl(source, str(tmp_path / 'shard_chilies.csv'), str(tmp_path / 'shard_results.csv'), workers=2)
+    finally:
+        configure_result_percentiles()
+
+    assert (tmp_path / 'Results.csv').read_text() == (
+        "Easy|average_total_time|15.0\nEasy|count|1\nEasy|median_total_time|15.0\nEasy|p95_total_time|15.0\n"
+        "Hard|average_total_time|65.0\nHard|count|1\nHard|median_total_time|65.0\nHard|p95_total_time|65.0\n")
+    assert (tmp_path / 'shard_results.csv').read_text() == (tmp_path / 'Results.csv').read_text()
+
+    # Workers started with spawn do not inherit the percentile settings of the parent process. Without duplicates the
+    # stats of the workers are merged as they are, instead of being recomputed from the kept rows.
+    with open(source, 'r') as file:
+        lines = file.readlines()
+    with open(source, 'w') as file:
+        file.writelines(lines[:4])
+    spawn_executor = lambda max_workers: ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'))
+    configure_result_percentiles([50, 95])
+    capsys.readouterr()
+    try:
+        with patch('src.main.ProcessPoolExecutor', spawn_executor):
+            run_sharded_etl(source, str(tmp_path / 'spawn_chilies.csv'), str(tmp_path / 'spawn_results.csv'), workers=2)
+    finally:
+        configure_result_percentiles()
+    # A failed shard runs again in this process, which has the settings, so the workers must not have failed
+    assert "failed" not in capsys.readouterr().out
+    assert (tmp_path / 'spawn_results.csv').read_text() == (tmp_path / 'Results.csv').read_text()